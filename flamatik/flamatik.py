@@ -41,13 +41,23 @@
 # Author: brian@bulkowski.org Brian Bulkowski 2024 Copyright assigned to Sam Cooler
 
 import socket
-from time import sleep, time
+import struct
+from time import sleep, time, monotonic, monotonic_ns
 import argparse
 import json
-from multiprocessing import Process, Event, Manager, Queue
+from multiprocessing import Process, Event, Manager, Queue, Lock
+from multiprocessing.sharedctypes import RawArray
 import queue
 import asyncio
 import math
+import ctypes
+import inspect
+from collections import namedtuple
+import itertools
+import random
+import traceback
+
+import numpy as np
 
 # let's use the Blocking call structure from pythonosc 
 from pythonosc.dispatcher import Dispatcher
@@ -59,16 +69,24 @@ from pythonosc import osc_server
 import netifaces
 # importlib is necessary for the strange plugin system
 import importlib
+import importlib.util
 #
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
+from http import HTTPStatus
+from urllib.parse import urlparse
+from threading import Thread
+import bisect
+import heapq
 
 import glob 
 import os
 import sys
+from contextlib import nullcontext, contextmanager
 
 from typing import Dict, List, Any
 
+# frame recording, in this directory
+import framelog
+
 import logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -85,6 +103,10 @@ ARTNET_HEADER_SIZE = 18
 NOZZLE_BUTTON_LEN = 30
 CONTROL_BUTTON_LEN = 3
 
+# how the shared state in LightCurveState is held, see the long comment below.
+# selected with "state_backend" in the config file, defaults to manager.
+STATE_BACKENDS = [ 'manager', 'shared_memory' ]
+
 debug = False
 
 # artnet packet format: ( 18 bytes )
@@ -121,6 +143,16 @@ def _artnet_packet(universe: int, sequence: int, packet: bytearray ):
 
     # print_bytearray(packet)
 
+# artsync packet format: ( 14 bytes )
+# 8 bytes header: 'Art-Net0'
+# 2 bytes: 00 0x52 (artsync)
+# 2 bytes: proto version 0 0x0e
+# 2 bytes: aux, 0
+#
+# A controller in sync mode holds on to the artdmx data it receives and only applies it when
+# the artsync arrives. Sent after all of a frame's artdmx, so every controller changes together.
+ARTSYNC_PACKET = b'Art-Net\x00\x00\x52\x00\x0e\x00\x00'
+
 #
 # This is a shared class, across processes. It is shared between processes
 # by simply passing it through the process create. This has the amusing property
@@ -166,6 +198,399 @@ def _artnet_packet(universe: int, sequence: int, packet: bytearray ):
 # is constructed once, indepenatly, in each process and used every time you want to create a new shared list.
 # I am guessing that the efficiency of accessing elements is cheaper than creating new arrays, which is usually
 # not the case in python. 
+#
+# Update: there is now a second backend, selected with "state_backend": "shared_memory" in the config
+# file. It allocates the same arrays as sharedctypes RawArrays, and hands out NumPy views of them.
+# Every process then reads and writes the same memory directly, with no proxy server round trip.
+# There are no locks: a single write to a nozzle is atomic enough for us, and the transmitter
+# already copies the arrays once per frame. The same rules apply as with the Manager:
+# mutate the arrays in place, don't replace them (the namespace below copies in if you try).
+
+
+class SharedMemoryNamespace:
+
+    # name: ctypes type of the element. sizes are fixed at creation
+    ARRAYS = {
+        'apertures': ctypes.c_double,
+        'solenoids': ctypes.c_int32,
+        'nozzle_buttons': ctypes.c_bool,
+        'nozzle_buttons_1': ctypes.c_bool,
+    }
+
+    # these are views into the IMU slot, see ImuSlot
+    IMU_ARRAYS = [ 'rotation', 'gravity', 'gyro' ]
+
+    def __init__(self, nozzles: int, imu: 'ImuSlot'):
+
+        lengths = {
+            'apertures': nozzles,
+            'solenoids': nozzles,
+            'nozzle_buttons': NOZZLE_BUTTON_LEN,
+            'nozzle_buttons_1': NOZZLE_BUTTON_LEN,
+        }
+        raw = { name: RawArray(ctype, lengths[name]) for name, ctype in self.ARRAYS.items() }
+
+        # the button receive times, NaN when nothing has been received (None in the manager namespace)
+        raw['last_recv'] = RawArray(ctypes.c_double, 2)
+        raw['last_recv'][:] = [math.nan, math.nan]
+
+        raw['imu'] = imu.raw_data
+
+        self._attach(raw)
+
+    # The RawArrays pickle when passed to a Process, but a NumPy view would pickle as a copy,
+    # so only the raw arrays travel and the views are rebuilt on the other side.
+    def __getstate__(self):
+        return { '_raw': self._raw }
+
+    def __setstate__(self, state):
+        self._attach(state['_raw'])
+
+    def _attach(self, raw):
+        object.__setattr__(self, '_raw', raw)
+        for name in raw:
+            object.__setattr__(self, name, np.ctypeslib.as_array(raw[name]))
+        for name in self.IMU_ARRAYS:
+            object.__setattr__(self, name, self.imu[ImuSlot.FIELDS[name]])
+
+    def __setattr__(self, name, value):
+        # same rule as the manager: never replace a shared array, copy into it
+        if name in self.ARRAYS or name in self.IMU_ARRAYS:
+            getattr(self, name)[:] = value
+        else:
+            object.__setattr__(self, name, value)
+
+    def _get_last_recv(self, i: int):
+        t = self._raw['last_recv'][i]
+        return None if math.isnan(t) else t
+
+    def _set_last_recv(self, i: int, t):
+        self._raw['last_recv'][i] = math.nan if t is None else t
+
+    nozzle_buttons_last_recv = property(lambda self: self._get_last_recv(0),
+                                        lambda self, t: self._set_last_recv(0, t))
+    nozzle_buttons_1_last_recv = property(lambda self: self._get_last_recv(1),
+                                          lambda self, t: self._set_last_recv(1, t))
+
+
+# The IMU slot holds the latest IMU sample in shared memory: receive time, the IMU's own
+# millisecond timestamp, and the 9 floats (rotation, gravity, gyro). The OSC process writes it
+# once per packet, and anyone can read a consistent copy of all of it in one call.
+#
+# It's a seqlock: the writer makes the counter odd, writes, and makes it even again. A reader
+# copies the data between two reads of the counter, and tries again if the counter was odd or moved.
+# There is only ever one writer, the OSC process.
+#
+# With the shared_memory backend, state.s.rotation, gravity and gyro are views into this slot, so
+# older patterns reading state.s.gravity[0] still see the latest sample.
+#
+# Samples are checked against the IMU's timestamp. One that isn't newer than the last is
+# counted as late and dropped (unless the timestamp jumped back a lot, which is the IMU restarting).
+# Gaps much longer than the usual spacing between samples are counted as dropped samples.
+
+ImuSample = namedtuple('ImuSample', [ 'seq', 'time', 'device_ms', 'rotation', 'gravity', 'gyro' ])
+
+IMU_RESTART_MS = 5000
+IMU_READ_TIMEOUT_NS = 10_000_000
+FRAME_READ_TIMEOUT_NS = 10_000_000
+
+class ImuSlot:
+
+    FIELDS = {
+        'time': 0,
+        'device_ms': 1,
+        'rotation': slice(2, 5),
+        'gravity': slice(5, 8),
+        'gyro': slice(8, 11),
+    }
+    DATA_LEN = 11
+
+    COUNTERS = [ 'seq', 'samples', 'late', 'dropped' ]
+
+    def __init__(self):
+        self._attach(RawArray(ctypes.c_double, self.DATA_LEN), RawArray(ctypes.c_uint64, len(self.COUNTERS)))
+
+    # see SharedMemoryNamespace, only the raw arrays are pickled
+    def __getstate__(self):
+        return { 'raw_data': self.raw_data, 'raw_counters': self.raw_counters }
+
+    def __setstate__(self, state):
+        self._attach(state['raw_data'], state['raw_counters'])
+
+    def _attach(self, raw_data, raw_counters):
+        self.raw_data = raw_data
+        self.raw_counters = raw_counters
+        self.data = np.ctypeslib.as_array(raw_data)
+        self.counters = raw_counters
+        # writer side bookkeeping, only used in the OSC process
+        self.last_device_ms = None
+        self.interval_ms = None
+
+    # write a sample. Parts not given keep their last value. device_ms None skips the timestamp checks.
+    # Returns False if the sample was late and dropped.
+    def write(self, device_ms = None, rotation = None, gravity = None, gyro = None) -> bool:
+
+        if device_ms is not None and not self._check(device_ms):
+            return False
+
+        c = self.counters
+        seq = c[0]
+        c[0] = seq + 1
+        self.data[0] = monotonic_ns() / 1_000_000_000
+        if device_ms is not None:
+            self.data[1] = device_ms
+        if rotation is not None:
+            self.data[2:5] = rotation
+        if gravity is not None:
+            self.data[5:8] = gravity
+        if gyro is not None:
+            self.data[8:11] = gyro
+        c[0] = seq + 2
+        c[1] += 1
+        return True
+
+    def _check(self, device_ms) -> bool:
+        last = self.last_device_ms
+        if last is not None and device_ms <= last and last - device_ms < IMU_RESTART_MS:
+            self.counters[2] += 1
+            return False
+
+        if last is not None and device_ms > last:
+            gap = device_ms - last
+            if self.interval_ms is None:
+                self.interval_ms = gap
+            elif gap > 1.5 * self.interval_ms:
+                self.counters[3] += round(gap / self.interval_ms) - 1
+            else:
+                # follow the IMU's rate slowly, ignoring the gaps
+                self.interval_ms += (gap - self.interval_ms) * 0.1
+
+        self.last_device_ms = device_ms
+        return True
+
+    def read(self) -> ImuSample:
+        c = self.counters
+        # bounded, in case the writer died in the middle of a write
+        give_up = monotonic_ns() + IMU_READ_TIMEOUT_NS
+        while True:
+            seq = c[0]
+            d = self.data.copy()
+            if (not seq & 1 and c[0] == seq) or monotonic_ns() > give_up:
+                break
+        f = self.FIELDS
+        return ImuSample(seq // 2, d[0], d[1], d[f['rotation']], d[f['gravity']], d[f['gyro']])
+
+    def stats(self) -> Dict[str, int]:
+        return dict(zip(self.COUNTERS, self.counters[:]))
+
+
+# The frame buffer lets a pattern publish complete frames. Without it, the transmitter copies
+# the live arrays while the pattern might be halfway through a loop, and a controller can get
+# 3 out of the 5 nozzles of a star.
+#
+# There are two published slots (front and back) and a sequence counter, all in shared memory.
+# commit() writes the slot the transmitter is NOT reading, then bumps the sequence, so the
+# newest complete frame is always in slot seq & 1. Each slot also has a version, a seqlock like
+# ImuSlot's: odd while the slot is being written, even after. The reader doesn't lock: it reads the
+# sequence and the slot's version, copies the slot, and tries again if the version was odd or changed,
+# which is the writer reusing the slot mid copy. One writer (the running pattern), any number of readers.
+#
+# Patterns that never commit are sent the live arrays, like always. Once a pattern commits, only
+# committed frames are sent until the next pattern starts (reset() is called then).
+
+class FrameBuffer:
+
+    def __init__(self, nozzles: int):
+        self.nozzles = nozzles
+        raw = {
+            'apertures': RawArray(ctypes.c_double, 2 * nozzles),
+            'solenoids': RawArray(ctypes.c_int32, 2 * nozzles),
+            'seq': RawArray(ctypes.c_uint64, 1),
+            # each slot's seqlock, odd while it's written
+            'version': RawArray(ctypes.c_uint64, 2),
+            # monotonic_ns of the commit of each slot
+            'commit_ns': RawArray(ctypes.c_int64, 2),
+            'active': RawArray(ctypes.c_bool, 1),
+        }
+        self._attach(raw)
+
+    # see SharedMemoryNamespace, only the raw arrays are pickled
+    def __getstate__(self):
+        return { 'nozzles': self.nozzles, '_raw': self._raw }
+
+    def __setstate__(self, state):
+        self.nozzles = state['nozzles']
+        self._attach(state['_raw'])
+
+    def _attach(self, raw):
+        self._raw = raw
+        self.apertures = np.ctypeslib.as_array(raw['apertures']).reshape(2, self.nozzles)
+        self.solenoids = np.ctypeslib.as_array(raw['solenoids']).reshape(2, self.nozzles)
+        self.commit_ns = np.ctypeslib.as_array(raw['commit_ns'])
+        self.seq = raw['seq']
+        self.version = raw['version']
+        self.active = raw['active']
+
+    def publish(self, apertures, solenoids) -> int:
+        seq = self.seq[0] + 1
+        slot = seq & 1
+        version = self.version[slot]
+        self.version[slot] = version + 1
+        self.apertures[slot] = apertures
+        self.solenoids[slot] = solenoids
+        self.commit_ns[slot] = monotonic_ns()
+        self.version[slot] = version + 2
+        self.seq[0] = seq
+        self.active[0] = True
+        return seq
+
+    def reset(self) -> None:
+        self.active[0] = False
+
+    # returns (apertures, solenoids, seq, commit_ns) of the latest committed frame as array copies,
+    # or None if the running pattern doesn't commit
+    def read(self):
+        # bounded, in case the writer died in the middle of a write
+        give_up = monotonic_ns() + FRAME_READ_TIMEOUT_NS
+        while self.active[0]:
+            seq = self.seq[0]
+            slot = seq & 1
+            version = self.version[slot]
+            apertures = self.apertures[slot].copy()
+            solenoids = self.solenoids[slot].copy()
+            commit_ns = int(self.commit_ns[slot])
+            if (not version & 1 and self.version[slot] == version) or monotonic_ns() > give_up:
+                return apertures, solenoids, seq, commit_ns
+        return None
+
+
+#
+# Solenoid edges at a time. Poofs set through state.s.solenoids are as long as some number of frames,
+# because that's when the transmitter looks. A pattern can instead ask for a solenoid to go on or off
+# at a time on its clock, state.solenoid_edge(nozzle, t, on) or state.poof(nozzle, seconds), and the
+# transmitter sends a packet at that time, between frames if it has to. A 50ms poof at 15 fps.
+#
+# The edges go through an EdgeQueue, a ring in shared memory: patterns write (under a lock, as two
+# patterns can overlap while one is stopping), the transmitter reads, and an Event wakes it up.
+# The transmitter keeps them in an EdgeSchedule until they're due. A solenoid an edge turned on is on
+# whatever the frame says, until an edge turns it off or the pattern that turned it on is stopped.
+#
+
+EDGE_SLOTS = 256
+
+class EdgeQueue:
+
+    def __init__(self) -> None:
+        raw = {
+            'time_ns': RawArray(ctypes.c_int64, EDGE_SLOTS),
+            'nozzle': RawArray(ctypes.c_int32, EDGE_SLOTS),
+            'on': RawArray(ctypes.c_int8, EDGE_SLOTS),
+            'job': RawArray(ctypes.c_int64, EDGE_SLOTS),
+            # written, read, dropped
+            'counters': RawArray(ctypes.c_uint64, 3),
+        }
+        self._attach(raw, Lock(), Event())
+
+    # see SharedMemoryNamespace, only the raw arrays are pickled (and the lock and event, which can be)
+    def __getstate__(self):
+        return { '_raw': self._raw, 'lock': self.lock, 'wake': self.wake }
+
+    def __setstate__(self, state):
+        self._attach(state['_raw'], state['lock'], state['wake'])
+
+    def _attach(self, raw, lock, wake) -> None:
+        self._raw = raw
+        self.time_ns = raw['time_ns']
+        self.nozzle = raw['nozzle']
+        self.on = raw['on']
+        self.job = raw['job']
+        self.counters = raw['counters']
+        self.lock = lock
+        self.wake = wake
+
+    # add edges, a list of (time_ns, nozzle, on), all or none of them. Returns False if there wasn't room.
+    def push(self, edges, job: int) -> bool:
+        with self.lock:
+            c = self.counters
+            written = c[0]
+            if written + len(edges) - c[1] > EDGE_SLOTS:
+                c[2] += 1
+                return False
+            for i, (time_ns, nozzle, on) in enumerate(edges):
+                slot = (written + i) % EDGE_SLOTS
+                self.time_ns[slot] = time_ns
+                self.nozzle[slot] = nozzle
+                self.on[slot] = on
+                self.job[slot] = job
+            c[0] = written + len(edges)
+        self.wake.set()
+        return True
+
+    # the edges written since the last pop, as (time_ns, nozzle, on, job). Only the transmitter calls this.
+    def pop(self) -> list:
+        c = self.counters
+        read, written = c[1], c[0]
+        edges = []
+        for i in range(read, written):
+            slot = i % EDGE_SLOTS
+            edges.append((self.time_ns[slot], self.nozzle[slot], self.on[slot], self.job[slot]))
+        c[1] = written
+        return edges
+
+
+class EdgeSchedule:
+
+    def __init__(self, queue: EdgeQueue, nozzles: int, runtime_ctl = None) -> None:
+        self.queue = queue
+        self.runtime_ctl = runtime_ctl
+        self.pending = []
+        self.order = itertools.count()
+        # the solenoids edges have turned on, and the job that did it
+        self.on = np.zeros(nozzles, dtype=np.int32)
+        self.owner = np.zeros(nozzles, dtype=np.int64)
+
+    def _stopped(self, job: int) -> bool:
+        return job != 0 and self.runtime_ctl is not None and self.runtime_ctl[RUNTIME_STOP] >= job
+
+    def pull(self) -> None:
+        for time_ns, nozzle, on, job in self.queue.pop():
+            heapq.heappush(self.pending, (time_ns, next(self.order), nozzle, on, job))
+
+    # when the next edge is due, or None
+    def next_ns(self):
+        self.pull()
+        return self.pending[0][0] if self.pending else None
+
+    # apply the edges due by now_ns, returns whether any were
+    def apply(self, now_ns: int) -> bool:
+        self.pull()
+        applied = False
+        while self.pending and self.pending[0][0] <= now_ns:
+            _, _, nozzle, on, job = heapq.heappop(self.pending)
+            if on and self._stopped(job):
+                continue
+            self.on[nozzle] = on
+            self.owner[nozzle] = job
+            applied = True
+        return applied
+
+    # turn off what stopped patterns left on
+    def release(self) -> None:
+        if self.on.any():
+            for nozzle in np.flatnonzero(self.on):
+                if self._stopped(self.owner[nozzle]):
+                    self.on[nozzle] = 0
+
+    def clear(self) -> None:
+        self.pull()
+        self.pending = []
+        self.on[:] = 0
+
+    # the frame's solenoids, with the ones edges turned on
+    def overlay(self, solenoids):
+        if not self.on.any():
+            return solenoids
+        return np.maximum(solenoids, self.on)
 
 
 class LightCurveState:
@@ -175,31 +600,59 @@ class LightCurveState:
         self.controllers = args.controllers
         self.nozzles = args.nozzles
         self.aperture_calibration = args.aperture_calibration
+        self.backend = args.state_backend
 
-# Please see long comments above about namespace.
-# especially regarding performance - avoid individual accesses (read or write)
-        self.s = manager.Namespace()
-        s = self.s
-        s.apertures = manager.list( [0.0] * self.nozzles )
-        s.solenoids = manager.list( [0] * self.nozzles )
+        if self.backend not in STATE_BACKENDS:
+            print(f' state backend {self.backend} should be one of {STATE_BACKENDS}')
+            raise Exception(" unknown state backend ")
 
-        # rotational speed around pitch, yaw, roll        
-        s.gyro = manager.list( [0.0] * 3 )
-        # absolute rotational position compared to a fixed reference frame
-        s.rotation = manager.list( [0.0] * 3 )
-        # the direction in which gravity currently is
-        s.gravity = manager.list( [0.0] * 3 )
+        # the latest IMU sample, see ImuSlot
+        self.imu = ImuSlot()
 
-        s.nozzle_buttons_last_recv = None
-        s.nozzle_buttons = manager.list( [False] * NOZZLE_BUTTON_LEN )
-        s.nozzle_buttons_1_last_recv = None
-        s.nozzle_buttons_1 = manager.list( [False] * NOZZLE_BUTTON_LEN )
+        if self.backend == 'shared_memory':
+            self.s = SharedMemoryNamespace(self.nozzles, self.imu)
+        else:
+            self.s = self._manager_namespace(manager)
 
         self.debug = debug
 
+
         # The arguments structure is a convenient way to get information to patterns.
         self.args = args
         self.command_queue = Queue() # multiprocessing queue
+        # flamatik_execute's answers to commands: (reply_id, accepted, reason)
+        self.command_replies = Queue()
+
+        # complete frames published by patterns with commit()
+        self.frames = FrameBuffer(self.nozzles)
+        # and the frames the transmitter sent, with edges, interpolation and buttons, for the status
+        self.sent_frames = FrameBuffer(self.nozzles)
+
+        # the transmitter's frame timing counters, see FrameScheduler
+        self.frame_stats = RawArray(ctypes.c_int64, len(FrameScheduler.STATS))
+
+        # the transmitter's timings, see TransmitMetrics
+        self.xmit_metrics = TransmitMetrics()
+
+        # what patterns tell the time with, see Clocks
+        self.clock = RealClock(args.fps, self.frame_stats)
+
+        # solenoid edges patterns have asked for, see EdgeQueue
+        self.edges = EdgeQueue()
+
+        # set by the transmitter when the frame changes, wakes the status transmitter
+        self.status_event = Event()
+
+        # jobs for the pattern workers, and their control words, see PatternHandle
+        self.runtime_jobs = Queue()
+        self.workers = max(2, getattr(args, 'workers', PATTERN_WORKERS))
+        self.runtime_ctl = RawArray(ctypes.c_int64, RUNTIME_SLOTS + 2 * self.workers)
+        self.preload = RawArray(ctypes.c_char, 64)
+        # set to wake each worker's sleeping pattern when it's stopped
+        self.runtime_wake = [ Event() for _ in range(self.workers) ]
+        # the job this process is running, if it is a pattern worker, and its wake event
+        self.job = 0
+        self.wake = None
 
         # validate the solenoid and aperture maps, make sure every nozzle is mapped
         solenoid_map = [-1] * self.nozzles
@@ -226,6 +679,26 @@ class LightCurveState:
                     print(f' aperture map: duplicate entry: controller {c["name"]} entry {i} value {controller_a_map[i]} is a dup')
                 aperture_map[controller_a_map[i]] = controller_a_map[i]
 
+    def _manager_namespace(self, manager):
+
+# Please see long comments above about namespace.
+# especially regarding performance - avoid individual accesses (read or write)
+        s = manager.Namespace()
+        s.apertures = manager.list( [0.0] * self.nozzles )
+        s.solenoids = manager.list( [0] * self.nozzles )
+
+        # rotational speed around pitch, yaw, roll        
+        s.gyro = manager.list( [0.0] * 3 )
+        # absolute rotational position compared to a fixed reference frame
+        s.rotation = manager.list( [0.0] * 3 )
+        # the direction in which gravity currently is
+        s.gravity = manager.list( [0.0] * 3 )
+
+        s.nozzle_buttons_last_recv = None
+        s.nozzle_buttons = manager.list( [False] * NOZZLE_BUTTON_LEN )
+        s.nozzle_buttons_1_last_recv = None
+        s.nozzle_buttons_1 = manager.list( [False] * NOZZLE_BUTTON_LEN )
+        return s
 
     def fill_apertures(self, val: float):
         self.s.apertures[:] = [val] * self.nozzles
@@ -247,6 +720,125 @@ class LightCurveState:
         else:
             self.fill_apertures(val)
 
+    # Bulk writes: set many nozzles in one access instead of one per nozzle.
+    # values is a single value or one per nozzle, nozzles is a list or array of nozzle indices,
+    # or None for all of them. See nozzle_arrays.py for building these.
+    def set_apertures(self, values, nozzles = None):
+        self._set_many('apertures', values, nozzles)
+
+    def set_solenoids(self, values, nozzles = None):
+        self._set_many('solenoids', values, nozzles)
+
+    def _set_many(self, name: str, values, nozzles):
+        if self.backend == 'shared_memory':
+            a = getattr(self.s, name)
+            if nozzles is None:
+                a[:] = values
+            else:
+                a[nozzles] = values
+            return
+
+        # with the manager, one read and one write of the whole list
+        if nozzles is None:
+            a = np.broadcast_to(values, self.nozzles)
+        else:
+            a = self.snapshot(name)
+            a[nozzles] = values
+        getattr(self.s, name)[:] = a.tolist()
+
+    # write an IMU sample, from the OSC process. With the manager the namespace lists are
+    # written too, for patterns that read state.s.gravity.
+    def imu_write(self, device_ms = None, rotation = None, gravity = None, gyro = None) -> None:
+        if not self.imu.write(device_ms, rotation, gravity, gyro):
+            return
+        if self.backend == 'manager':
+            if rotation is not None:
+                self.s.rotation[:] = rotation
+            if gravity is not None:
+                self.s.gravity[:] = gravity
+            if gyro is not None:
+                self.s.gyro[:] = gyro
+
+    # a consistent copy of the latest IMU sample, in one call. See ImuSlot.
+    def imu_snapshot(self) -> ImuSample:
+        return self.imu.read()
+
+    # publish the current apertures and solenoids as one complete frame. See FrameBuffer.
+    # A stopped pattern doesn't: the next one may already be running, and a stale committed frame
+    # would hide its live arrays. Returns 0 then.
+    def commit(self) -> int:
+        if self.cancelled():
+            return 0
+        if self.backend == 'shared_memory':
+            return self.frames.publish(self.s.apertures, self.s.solenoids)
+        return self.frames.publish(self.s.apertures[:], self.s.solenoids[:])
+
+    # turn solenoids on or off at time t, seconds on the pattern clock (state.now()). nozzle is one or a
+    # list. Returns False if too many edges are waiting already. See EdgeQueue.
+    def solenoid_edge(self, nozzle, t: float, on: bool) -> bool:
+        nozzles = [nozzle] if np.isscalar(nozzle) else nozzle
+        t_ns = int(t * 1_000_000_000)
+        return self.edges.push([ (t_ns, int(n), int(on)) for n in nozzles ], self.job)
+
+    # a poof of exactly this many seconds, starting at start (default now)
+    def poof(self, nozzle, seconds: float, start: float = None) -> bool:
+        nozzles = [nozzle] if np.isscalar(nozzle) else nozzle
+        start_ns = self.clock.now_ns() if start is None else int(start * 1_000_000_000)
+        end_ns = start_ns + int(seconds * 1_000_000_000)
+        edges = [ (start_ns, int(n), 1) for n in nozzles ] + [ (end_ns, int(n), 0) for n in nozzles ]
+        return self.edges.push(edges, self.job)
+
+    # or, as a context manager, which commits at the end of the block:
+    #   with state.frame():
+    #       for nozzle in star:
+    #           state.s.apertures[nozzle] = val
+    @contextmanager
+    def frame(self):
+        yield self
+        self.commit()
+
+    # true once the running pattern has been asked to stop. A pattern that loops without
+    # sleeping should check this now and then, and return.
+    def cancelled(self) -> bool:
+        return self.job != 0 and self.runtime_ctl[RUNTIME_STOP] >= self.job
+
+    # pattern timing, from self.clock (see Clocks). All of them raise PatternCancelled as soon as
+    # the pattern is asked to stop. Pattern modules' `sleep` is replaced by state.sleep.
+
+    # seconds, on the clock
+    def now(self) -> float:
+        return self.clock.now_ns() / 1_000_000_000
+
+    def sleep_until(self, t: float) -> None:
+        self.clock.sleep_until_ns(int(t * 1_000_000_000), self.cancelled, self.wake)
+
+    def sleep(self, seconds: float) -> None:
+        self.clock.sleep_until_ns(self.clock.now_ns() + int(seconds * 1_000_000_000), self.cancelled, self.wake)
+
+    # until just before the n'th next frame is sent, so what's set now is in it
+    def sleep_frames(self, n: int = 1) -> None:
+        self.clock.sleep_until_ns(self.clock.frame_ns(n), self.cancelled, self.wake)
+
+    # the frame to send: the latest committed one, or the live arrays if the pattern doesn't commit
+    def current_frame(self):
+        apertures, solenoids, _ = self.current_frame_ns()
+        return apertures, solenoids
+
+    # the same, and when it was committed, None for the live arrays
+    def current_frame_ns(self):
+        frame = self.frames.read()
+        if frame is not None:
+            return frame[0], frame[1], frame[3]
+        return self.snapshot('apertures'), self.snapshot('solenoids'), None
+
+    # take a copy of one of the shared arrays as a NumPy array, in one access.
+    # with the manager that is a single proxy call, with shared memory a copy out of the view
+    def snapshot(self, name: str) -> np.ndarray:
+        a = getattr(self.s, name)
+        if self.backend == 'shared_memory':
+            return a.copy()
+        return np.array(a[:])
+
     def print_aperture(self):
         print(self.s.apertures)
 
@@ -278,6 +870,107 @@ class LightCurveState:
 #
 
 
+#
+# Aperture interpolation. A pattern that moves the apertures every 200ms looks stepped, the servos
+# jump to each new position. With --interpolate, the transmitter takes each new set of apertures as a
+# key, and sends a curve from the previous key to it at the full fps, arriving one key interval later
+# (at most --interpolate-max seconds, so a pattern that holds still for a while then moves doesn't
+# crawl). The pattern can then run at its own slow rate and still look smooth.
+#
+# A key is a commit (at its commit time), or for patterns that don't commit, the live apertures
+# changing (at the frame they were seen). Solenoids aren't interpolated or delayed, and only the
+# apertures of open solenoids are: a nozzle that's closed, or just opened, goes straight to the key's
+# aperture and stays there for the rest of the move, so a poof opens at the aperture the pattern asked
+# for, not partway there.
+# A nozzle already open when a key arrives still gets there one move later.
+#
+#   linear  straight from one key to the next
+#   cubic   a Hermite curve, the slope at the start from the key before, so moves ease through keys
+#
+
+INTERPOLATIONS = [ 'none', 'linear', 'cubic' ]
+
+class ApertureInterpolator:
+
+    def __init__(self, kind: str, max_ns: int) -> None:
+        self.kind = kind
+        self.max_ns = max_ns
+        # the last three keys, (time_ns, apertures)
+        self.keys = []
+        # what was sent last, and when
+        self.sent = None
+        self.sent_ns = 0
+        # the move being made: from, when, how long, and the nozzles already at the end of it
+        self.start = None
+        self.start_ns = 0
+        self.duration_ns = 0
+        self.settled = None
+        # the solenoids open last time
+        self.open = None
+
+    # the apertures to send at now_ns, given the pattern's and the solenoids being sent with them,
+    # and when they were committed if they were
+    def __call__(self, apertures: np.ndarray, solenoids: np.ndarray, now_ns: int, commit_ns = None) -> np.ndarray:
+
+        last = self.keys[-1] if self.keys else None
+        if commit_ns is not None:
+            new = last is None or commit_ns != last[0]
+        else:
+            new = last is None or not np.array_equal(apertures, last[1])
+
+        if new:
+            t_ns = commit_ns if commit_ns is not None else now_ns
+            self.keys.append((t_ns, apertures))
+            del self.keys[:-3]
+            # the move starts from what was sent last, so one that hadn't arrived yet carries on from
+            # where it got to instead of jumping, and takes as long as the pattern took between keys
+            if self.sent is not None and last is not None:
+                self.start, self.start_ns = self.sent, self.sent_ns
+                self.duration_ns = max(1, min(t_ns - last[0], self.max_ns))
+            else:
+                self.start, self.duration_ns = apertures, 0
+            self.settled = np.zeros(len(apertures), dtype=bool)
+
+        # closed, or just opened
+        open = np.asarray(solenoids) > 0
+        self.settled |= ~open
+        if self.open is not None:
+            self.settled |= ~self.open
+        self.open = open
+        a = self.interpolate(now_ns)
+        if self.settled.any():
+            a = np.where(self.settled, self.keys[-1][1], a)
+
+        self.sent = a
+        self.sent_ns = now_ns
+        return self.sent
+
+    def interpolate(self, now_ns: int) -> np.ndarray:
+
+        p1, p2 = self.start, self.keys[-1][1]
+        if self.duration_ns == 0:
+            return p2
+        u = (now_ns - self.start_ns) / self.duration_ns
+        if u >= 1.0:
+            return p2
+        u = max(u, 0.0)
+
+        if self.kind == 'linear' or len(self.keys) < 3:
+            return p1 + (p2 - p1) * u
+
+        # slopes in apertures per move: at the start across the keys either side, at the end along the move
+        (t0, p0), _, (t2, _) = self.keys
+        m1 = (p2 - p0) * (self.duration_ns / max(1, t2 - t0))
+        m2 = p2 - p1
+        u2 = u * u
+        u3 = u2 * u
+        a = (2 * u3 - 3 * u2 + 1) * p1 + (u3 - 2 * u2 + u) * m1 + (-2 * u3 + 3 * u2) * p2 + (u3 - u2) * m2
+        return np.clip(a, 0.0, 1.0)
+
+
+# with --artnet-keepalive, a controller's packet is still sent this many frames after it changes
+KEEPALIVE_CHANGE_FRAMES = 3
+
 class LightCurveTransmitter:
 
     def __init__(self, state: LightCurveState) -> None:
@@ -293,6 +986,47 @@ class LightCurveTransmitter:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
+        self.controller_packets = [ ControllerPacket(c, state, self) for c in state.controllers ]
+        # controllers with "artsync": true in the config get an artsync after each frame
+        self.sync_controllers = [ cp for cp in self.controller_packets if cp.artsync ]
+
+        # 0 sends every frame. Otherwise a controller's packet is only sent when it changes, for
+        # KEEPALIVE_CHANGE_FRAMES frames after it changes (so a lost packet, like the one closing a
+        # solenoid, is made good on the next frame, as it is without a keepalive), and this often
+        # when it doesn't (the controllers go to art mode after 2 minutes without one)
+        self.keepalive_ns = int(getattr(state.args, 'artnet_keepalive', 0.0) * 1_000_000_000)
+
+        # frames with a solenoid edge are sent edge_repeats more times, edge_spacing_ns apart.
+        # bursts holds what's left to send for each controller: [ due_ns, copies left, packet ].
+        # It's the same packet, same sequence number, so a controller that gets two just applies it twice.
+        self.edge_repeats = getattr(state.args, 'edge_repeats', 0)
+        self.edge_spacing_ns = int(getattr(state.args, 'edge_spacing', 5.0) * 1_000_000)
+        self.bursts = {}
+
+        # solenoid edges patterns scheduled, see EdgeQueue
+        self.edges = EdgeSchedule(state.edges, state.nozzles, state.runtime_ctl)
+
+        # see ApertureInterpolator
+        interpolate = getattr(state.args, 'interpolate', 'none')
+        if interpolate not in INTERPOLATIONS:
+            print(f' interpolate {interpolate} should be one of {INTERPOLATIONS}')
+            raise Exception(" unknown interpolation ")
+        self.interpolator = None
+        if interpolate != 'none':
+            self.interpolator = ApertureInterpolator(interpolate, int(getattr(state.args, 'interpolate_max', 0.5) * 1_000_000_000))
+
+        # the last frame sent, to notice changes
+        self.last_frame = None
+
+        self.metrics = state.xmit_metrics
+
+        # keeps a log of the frames sent, see framelog.py
+        self.recorder = None
+        if getattr(state.args, 'record', None):
+            self.recorder = framelog.FrameRecorder(state.args.record, state.nozzles,
+                file_bytes = int(state.args.record_mb * 1024 * 1024), files = state.args.record_files)
+            print(f' recording frames to {state.args.record}')
+
     # this takes the 0 to 1 value from the pattern,
     # applies the per nozzle calibration, and returns the corrected
     # value for sending to the controller, using the table 
@@ -306,6 +1040,15 @@ class LightCurveTransmitter:
         return ((stop-start) * val) + start
 
 
+    def frame_changed(self, apertures, solenoids, buttons) -> bool:
+        last = self.last_frame
+        self.last_frame = (apertures, solenoids, buttons)
+        if last is None:
+            return True
+        return not (np.array_equal(last[0], apertures) and np.array_equal(last[1], solenoids)
+                    and np.array_equal(last[2], buttons))
+
+
 # note about the mapping.
 # Each controller contains an array called "solenoid_map" and "aperture_map".
 # this becomes an indirection table.
@@ -318,73 +1061,473 @@ class LightCurveTransmitter:
 
         use_buttons = not self.state.args.nobuttons
 
+        t0 = monotonic_ns()
+
         # take a copy of the shared array for performance
-        nozzle_buttons = self.state.s.nozzle_buttons[:]
-        nozzle_buttons_1 = self.state.s.nozzle_buttons_1[:]
-        apertures = self.state.s.apertures[:]
-        solenoids = self.state.s.solenoids[:]
+        apertures, solenoids, commit_ns = self.state.current_frame_ns()
+        self.edges.apply(monotonic_ns())
+        self.edges.release()
+        solenoids = self.edges.overlay(solenoids)
+        if self.interpolator is not None:
+            apertures = self.interpolator(apertures, solenoids, t0, commit_ns)
+
+        # if the flag is set, override what the pattern wants with the information
+        # we received over OSC. This is a very primitive form of pattern mixing.
+        # We could also build a more arbitrary one.
+        # also note that the button wants all the fire, so we have to also set the servo to 1.0
+        if use_buttons:
+            buttons = self.state.snapshot('nozzle_buttons') | self.state.snapshot('nozzle_buttons_1')
+        else:
+            buttons = None
 
-        for c in self.state.controllers:
+        self.metrics.add('read', monotonic_ns() - t0)
 
-            # allocate the packet TODO allocate a packet once
-            packet = bytearray( ( self.state.nozzles * 2) + ARTNET_HEADER_SIZE)
+        sequence = self.sequence
+        self.send(apertures, solenoids, buttons)
 
-            # fill in the artnet part
-            _artnet_packet(ARTNET_UNIVERSE, self.sequence, packet)
+        if self.recorder is not None:
+            self.recorder.record(monotonic_ns(), sequence, apertures, solenoids, buttons, self.state.imu_snapshot())
 
-            aperture_map = c['aperture_map']
-            solenoid_map = c['solenoid_map']
+    # send one logical frame to all the controllers, through the mapping and calibration
+    def send(self, apertures, solenoids, buttons) -> None:
 
-            # fill in the data bytes
-            for i in range(c['nozzles']):
+        # wake up the status transmitter if anything it reports changed, and give it the frame
+        if self.frame_changed(apertures, solenoids, buttons):
+            self.state.sent_frames.publish(apertures, solenoids if buttons is None else np.where(buttons[:len(solenoids)], 1, solenoids))
+            self.state.status_event.set()
 
-                solenoid = solenoid_map [ i ]
-                aperture = aperture_map [ i ]
-
-                # print(f'c: {c['name']} packet solenoid {i} model solenoid {solenoid}')
-                # print(f'c: {c['name']} packet aperture {i} model aperture {aperture}')
-
-                # validation. Could make optional.
-                # self.state.s.solenoids = [0 if s is None else s for s in self.state.s.solenoids]
-                # self.state.s.apertures = [0 if a is None else a for a in self.state.s.apertures]
-                # if (self.debug and
-                #         ( self.state.s.solenoids[solenoid] < 0) or (self.state.s.solenoids[solenoid] > 1)):
-                #     print(f'active at {i+offset} out of range {self.state.s.solenoids[solenoid]} skipping')
-                #     return
-                # if (self.debug and
-                #         (self.state.s.apertures[aperture] < 0.0) or (self.state.s.apertures[aperture] > 1.0)):
-                #     print(f'flow at {i+offset} out of range {self.state.s.apertures[aperture]} skipping')
-
-                # compose in the buttons if enabled
-
-                # if the flag is set, override what the pattern wants with the information
-                # we received over OSC. This is a very primitive form of pattern mixing.
-                # We could also build a more arbitrary one.
-                # also note that the button wants all the fire, so we have to also set the servo to 1.0
-
-                if use_buttons and ((nozzle_buttons[solenoid]) or (nozzle_buttons_1[solenoid])):
-                    # print(f' firing logical {i} physical {solenoid} because button')
-                    s = True
-                else:
-                    s = solenoids[solenoid]
-
-                if use_buttons and ((nozzle_buttons[aperture]) or (nozzle_buttons_1[aperture])):
-                    a = 1.0
-                else:
-                    a = apertures[aperture]
+        encode_ns = send_ns = 0
+        synced = False
+        for cp in self.controller_packets:
 
-                packet[ARTNET_HEADER_SIZE + (i*2) ] = s
+            t0 = monotonic_ns()
+            cp.fill(apertures, solenoids, buttons, self.sequence)
+            t1 = monotonic_ns()
+            encode_ns += t1 - t0
 
-                packet[ARTNET_HEADER_SIZE + (i*2) + 1] = math.floor(self.nozzle_apply_calibration( aperture, a ) )
+            # with a keepalive, only send what changed or changed lately, or when it's been keepalive since the last
+            if (self.keepalive_ns and not cp.changed() and cp.unchanged >= KEEPALIVE_CHANGE_FRAMES
+                    and t1 - cp.sent_ns < self.keepalive_ns):
+                self.metrics.count('packets_suppressed')
+                continue
 
             # transmit
             if self.debug:
-                print(f' sending packet to {c["ip"]} for {c["name"]}')
-                print_bytearray(packet)
+                print(f' sending packet to {cp.ip} for {cp.name}')
+                print_bytearray(cp.packet)
+
+            # a solenoid edge is sent again a few times, so losing one packet doesn't leave a flame on
+            edge = cp.solenoids_changed()
+            self.sendto(cp.packet, cp)
+            cp.sent(t1)
+            self.metrics.count('packets_sent')
+            synced = synced or cp.artsync
+
+            self.bursts.pop(cp, None)
+            if edge and self.edge_repeats:
+                self.bursts[cp] = [ t1 + self.edge_spacing_ns, self.edge_repeats, bytes(cp.packet) ]
+
+            send_ns += monotonic_ns() - t1
+
+        # all the data is out, now tell the controllers that sync to apply it
+        if synced:
+            t1 = monotonic_ns()
+            for cp in self.sync_controllers:
+                self.sendto(ARTSYNC_PACKET, cp)
+            send_ns += monotonic_ns() - t1
+
+        self.metrics.add('encode', encode_ns)
+        self.metrics.add('send', send_ns)
+        self.sequence += 1
 
-            self.sock.sendto(packet, (c['ip'], ARTNET_PORT))
+    # when the next packet between frames is due, or None
+    def next_due_ns(self):
+        due = [ b[0] for b in self.bursts.values() ]
+        edge_ns = self.edges.next_ns()
+        if edge_ns is not None:
+            due.append(edge_ns)
+        return min(due) if due else None
+
+    # send what's due between frames, on time, until deadline_ns (or until nothing is)
+    def send_due_until(self, deadline_ns = None) -> None:
+        while (due_ns := self.next_due_ns()) is not None and (deadline_ns is None or due_ns < deadline_ns):
+            sleep(max(0, due_ns - monotonic_ns()) / 1_000_000_000)
+            self.send_due(monotonic_ns())
+
+    # send what's due between frames: a frame if a solenoid edge is due, then edge repeats
+    def send_due(self, now_ns: int) -> None:
+        edge_ns = self.edges.next_ns()
+        if edge_ns is not None and edge_ns <= now_ns:
+            self.transmit()
+        synced = False
+        for cp, b in list(self.bursts.items()):
+            if b[0] > now_ns:
+                continue
+            self.sendto(b[2], cp)
+            self.metrics.count('edge_repeats')
+            synced = synced or cp.artsync
+            b[0] += self.edge_spacing_ns
+            b[1] -= 1
+            if b[1] <= 0:
+                del self.bursts[cp]
+        if synced:
+            for cp in self.sync_controllers:
+                self.sendto(ARTSYNC_PACKET, cp)
+
+    def sendto(self, packet, cp: 'ControllerPacket') -> None:
+        try:
+            self.sock.sendto(packet, (cp.ip, ARTNET_PORT))
+        except OSError as e:
+            # a controller that's gone or a network that's down shouldn't stop the others
+            self.metrics.count('send_errors')
+            print(f' send to {cp.name} {cp.ip} failed: {e}') if self.debug else None
 
-        self.sequence += 1
+    def close(self) -> None:
+        if self.recorder is not None:
+            self.recorder.close()
+            print(f'transmit server: recorded {self.recorder.recorded} frames, dropped {self.recorder.dropped}')
+
+#
+# The packet for one controller is built once, at startup. The header never changes except for
+# the sequence byte, and the mapping and calibration become NumPy index and scale arrays, so
+# filling in a frame is a handful of array operations into the preallocated packet.
+#
+# The packet has room for all the nozzles (solenoid and aperture interleaved), the controller
+# only uses the first c['nozzles'] pairs, the rest stay 0.
+#
+
+class ControllerPacket:
+
+    def __init__(self, c, state: LightCurveState, xmit: LightCurveTransmitter) -> None:
+
+        self.name = c['name']
+        self.ip = c['ip']
+        self.artsync = c.get('artsync', False)
+        n = c['nozzles']
+
+        self.packet = bytearray( ( state.nozzles * 2) + ARTNET_HEADER_SIZE)
+        _artnet_packet(ARTNET_UNIVERSE, 0, self.packet)
+
+        # views into the packet data, solenoid and aperture bytes are interleaved
+        data = np.frombuffer(self.packet, dtype=np.uint8, offset=ARTNET_HEADER_SIZE)
+        self.data = data
+        self.solenoid_bytes = data[0:n*2:2]
+        self.aperture_bytes = data[1:n*2:2]
+
+        # the data last sent, when, and how many times since it changed, see LightCurveTransmitter.keepalive_ns
+        self.sent_data = None
+        self.sent_ns = 0
+        self.unchanged = 0
+
+        # packet position -> logical nozzle
+        self.solenoid_idx = np.array(c['solenoid_map'][:n], dtype=np.intp)
+        self.aperture_idx = np.array(c['aperture_map'][:n], dtype=np.intp)
+
+        # calibration of the nozzle in each aperture position: value * scale + offset
+        self.aperture_offset = np.array([ xmit.nozzle_apply_calibration(a, 0.0) for a in c['aperture_map'][:n] ])
+        self.aperture_scale = np.array([ xmit.nozzle_apply_calibration(a, 1.0) for a in c['aperture_map'][:n] ]) - self.aperture_offset
+
+    # whether the data filled in is different from what was last sent
+    def changed(self) -> bool:
+        return self.sent_data is None or not np.array_equal(self.data, self.sent_data)
+
+    # whether any solenoid filled in is different from what was last sent
+    def solenoids_changed(self) -> bool:
+        return self.sent_data is not None and not np.array_equal(self.solenoid_bytes, self.sent_data[0:len(self.solenoid_bytes)*2:2])
+
+    def sent(self, now_ns: int) -> None:
+        if self.sent_data is None:
+            self.sent_data = self.data.copy()
+        elif self.changed():
+            self.sent_data[:] = self.data
+            self.unchanged = 0
+        else:
+            self.unchanged += 1
+        self.sent_ns = now_ns
+
+    def fill(self, apertures: np.ndarray, solenoids: np.ndarray, buttons, sequence: int) -> None:
+
+        s = solenoids[self.solenoid_idx]
+        a = apertures[self.aperture_idx]
+
+        if buttons is not None:
+            s = np.where(buttons[self.solenoid_idx], 1, s)
+            a = np.where(buttons[self.aperture_idx], 1.0, a)
+
+        self.solenoid_bytes[:] = s
+        # floor like the calibration always did, and keep it in a byte
+        self.aperture_bytes[:] = np.clip(np.floor(a * self.aperture_scale + self.aperture_offset), 0, 255)
+
+        self.packet[12] = sequence & 0xff
+
+
+#
+# Frame scheduler for the transmitter.
+#
+# Deadlines are absolute: frame n goes out at epoch + n * period, on the monotonic clock, so
+# a slow frame doesn't push every later frame back, and an NTP step on the Pi doesn't move anything.
+# Sleeping on Linux usually wakes up a little late. With spin, it sleeps until 1ms before
+# the deadline, and busy waits the rest. That costs some CPU, and buys much tighter frame spacing.
+#
+# If the transmitter falls more than a whole frame behind, the frames it missed are skipped
+# (not sent in a burst) and counted. A frame sent more than a tenth of a period after its
+# deadline is counted as late.
+#
+# The counters live in shared memory (LightCurveState.frame_stats) so other processes can read them.
+#
+
+SPIN_NS = 1_000_000
+
+# how long before a frame deadline the transmitter stops waiting for solenoid edges, and leaves the rest to the scheduler
+EDGE_WAKE_NS = 2_000_000
+
+class FrameScheduler:
+
+    STATS = [ 'frames', 'late', 'missed', 'max_late_ns', 'epoch_ns', 'period_ns' ]
+
+    def __init__(self, fps: float, spin: bool = False, stats = None) -> None:
+        self.period_ns = int(1_000_000_000 / fps)
+        self.late_ns = self.period_ns // 10
+        self.spin_ns = SPIN_NS if spin else 0
+        self.stats = stats if stats is not None else RawArray(ctypes.c_int64, len(self.STATS))
+        self.next_ns = None
+        self.last_late_ns = 0
+
+    def _add(self, name: str, v: int) -> None:
+        self.stats[self.STATS.index(name)] += v
+
+    # start the frame clock at an existing epoch, so this scheduler ticks in step with another one.
+    # the next deadline is the first one after now.
+    def align(self, epoch_ns: int) -> None:
+        now = monotonic_ns()
+        self.next_ns = epoch_ns + ((now - epoch_ns) // self.period_ns) * self.period_ns
+
+    def start(self) -> None:
+        self.next_ns = monotonic_ns()
+        self.stats[self.STATS.index('epoch_ns')] = self.next_ns
+        self.stats[self.STATS.index('period_ns')] = self.period_ns
+
+    # when wait() will return next, if it's not already late
+    def next_deadline_ns(self) -> int:
+        if self.next_ns is None:
+            return monotonic_ns()
+        return self.next_ns + self.period_ns
+
+    # wait for the next frame deadline, returns how many frames were missed getting here
+    def wait(self) -> int:
+        if self.next_ns is None:
+            self.start()
+            self._add('frames', 1)
+            return 0
+
+        self.next_ns += self.period_ns
+        now = monotonic_ns()
+
+        missed = 0
+        if now - self.next_ns >= self.period_ns:
+            missed = (now - self.next_ns) // self.period_ns
+            self.next_ns += missed * self.period_ns
+            self._add('missed', missed)
+
+        remaining = self.next_ns - now
+        if remaining > self.spin_ns:
+            sleep((remaining - self.spin_ns) / 1_000_000_000)
+        if self.spin_ns:
+            while monotonic_ns() < self.next_ns:
+                pass
+
+        late = monotonic_ns() - self.next_ns
+        self.last_late_ns = late
+        if late > self.late_ns:
+            self._add('late', 1)
+        if late > self.stats[self.STATS.index('max_late_ns')]:
+            self.stats[self.STATS.index('max_late_ns')] = late
+
+        self._add('frames', 1)
+        return missed
+
+    # the counters, as a dict, readable from any process holding the array
+    @staticmethod
+    def read_stats(stats) -> Dict[str, int]:
+        return dict(zip(FrameScheduler.STATS, stats[:]))
+
+
+#
+# Transmit metrics. The transmitter times each part of every frame into a RingHistogram, a fixed size
+# ring of the last RING_SAMPLES samples in shared memory, so the command server (another process) can
+# summarize them: GET /metrics on the command port. Nothing grows, and recording a sample is two stores.
+#
+#   read    getting the frame and buttons out of the shared state (the proxy round trips, with the manager)
+#   encode  filling in the controller packets
+#   send    the sendto() calls
+#   jitter  how late the frame started after its deadline
+#
+# along with counters of socket send errors, Art-Net packets sent and suppressed (--artnet-keepalive),
+# solenoid edge repeats (--edge-repeats), and the scheduler's frame, late and missed counts.
+#
+
+RING_SAMPLES = 1024
+
+# upper bounds of the histogram buckets, microseconds
+METRIC_BUCKETS_US = [ 10, 100, 1000, 10000 ]
+
+class RingHistogram:
+
+    def __init__(self, size: int = RING_SAMPLES) -> None:
+        self.size = size
+        self.samples = RawArray(ctypes.c_int64, size)
+        self.count = RawArray(ctypes.c_int64, 1)
+
+    def add(self, ns: int) -> None:
+        c = self.count[0]
+        self.samples[c % self.size] = ns
+        self.count[0] = c + 1
+
+    # percentiles and buckets over what's in the ring, microseconds
+    def summary(self) -> Dict[str, Any]:
+        n = min(self.count[0], self.size)
+        if n == 0:
+            return { 'count': 0 }
+        us = np.frombuffer(self.samples, dtype=np.int64)[:n] / 1000.0
+        p50, p90, p99 = np.percentile(us, [50, 90, 99])
+        buckets = np.histogram(us, bins=[-np.inf] + METRIC_BUCKETS_US + [np.inf])[0]
+        labels = [ f'<={b}' for b in METRIC_BUCKETS_US ] + [ f'>{METRIC_BUCKETS_US[-1]}' ]
+        return {
+            'count': int(self.count[0]),
+            'p50_us': round(p50, 1), 'p90_us': round(p90, 1), 'p99_us': round(p99, 1),
+            'max_us': round(float(us.max()), 1),
+            'buckets_us': dict(zip(labels, buckets.tolist())),
+        }
+
+
+class TransmitMetrics:
+
+    HISTOGRAMS = [ 'read', 'encode', 'send', 'jitter' ]
+    COUNTERS = [ 'send_errors', 'packets_sent', 'packets_suppressed', 'edge_repeats' ]
+
+    def __init__(self) -> None:
+        self.histograms = { name: RingHistogram() for name in self.HISTOGRAMS }
+        self.counters = RawArray(ctypes.c_int64, len(self.COUNTERS))
+
+    def add(self, name: str, ns: int) -> None:
+        self.histograms[name].add(ns)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[self.COUNTERS.index(name)] += n
+
+    def summary(self, frame_stats = None) -> Dict[str, Any]:
+        r = { name: h.summary() for name, h in self.histograms.items() }
+        r.update(zip(self.COUNTERS, self.counters[:]))
+        if frame_stats is not None:
+            r['frames'] = FrameScheduler.read_stats(frame_stats)
+        return r
+
+    # a few numbers, small enough for the status broadcast
+    def brief(self, frame_stats) -> Dict[str, Any]:
+        stats = FrameScheduler.read_stats(frame_stats)
+        return {
+            'missed': stats['missed'],
+            'late': stats['late'],
+            'send_errors': self.counters[self.COUNTERS.index('send_errors')],
+            'jitter_p99_us': self.histograms['jitter'].summary().get('p99_us'),
+            'frame_p99_us': max(self.histograms[n].summary().get('p99_us', 0) for n in ('read', 'encode', 'send')),
+        }
+
+
+#
+# Clocks
+#
+# Patterns tell the time with state.now(), state.sleep(), state.sleep_until(t) and state.sleep_frames(n),
+# and `from time import sleep` in a pattern file is state.sleep where patterns run. Behind those is
+# state.clock: a RealClock, the monotonic clock, in flamatik, and a VirtualClock when rendering, where
+# sleeping moves time on without waiting, so patterns run as fast as they can.
+#
+# sleep_frames wakes half a frame before a transmitter frame deadline, like frame patterns do, so a
+# pattern that times itself in frames stays in step with what's sent rather than drifting against it.
+#
+# A clock works in nanoseconds: now_ns(), sleep_until_ns(t, cancelled, wake) which checks cancelled() as it
+# waits and raises PatternCancelled, and frame_ns(n), when to wake for the n'th next frame. wake is an
+# Event set when the pattern is stopped (see PatternHandle.terminate), so a sleep ends right away
+# without waking up to poll.
+#
+
+class Clock:
+
+    def __init__(self, fps: float) -> None:
+        self.period_ns = int(1_000_000_000 / fps)
+
+    def epoch_ns(self) -> int:
+        return 0
+
+    def frame_ns(self, n: int = 1) -> int:
+        wake_ns = self.epoch_ns() - self.period_ns // 2
+        return wake_ns + ((self.now_ns() - wake_ns) // self.period_ns + n) * self.period_ns
+
+
+class RealClock(Clock):
+
+    def __init__(self, fps: float, frame_stats = None) -> None:
+        super().__init__(fps)
+        self.frame_stats = frame_stats
+
+    def now_ns(self) -> int:
+        return monotonic_ns()
+
+    # the transmitter's, once it has started
+    def epoch_ns(self) -> int:
+        if self.frame_stats is not None:
+            epoch_ns = self.frame_stats[FrameScheduler.STATS.index('epoch_ns')]
+            if epoch_ns:
+                return epoch_ns
+        return 0
+
+    def sleep_until_ns(self, t_ns: int, cancelled = lambda: False, wake = None) -> None:
+        while True:
+            if cancelled():
+                raise PatternCancelled()
+            remaining = t_ns - monotonic_ns()
+            if remaining <= 0:
+                return
+            if wake is None:
+                sleep(remaining / 1_000_000_000)
+            elif wake.wait(remaining / 1_000_000_000) and not cancelled():
+                # set for a job that's gone, the stop always comes before the wake
+                wake.clear()
+
+
+class ClockFinished(Exception):
+    pass
+
+# Simulated time, starting at 0. Sleeping moves it on straight away, calling on_frame(t_ns) for every
+# frame deadline passed (including the one it lands on), with things as the pattern left them, and
+# raising ClockFinished at end_ns.
+
+class VirtualClock(Clock):
+
+    def __init__(self, fps: float, end_ns: int = None, on_frame = None) -> None:
+        super().__init__(fps)
+        self.end_ns = end_ns
+        self.on_frame = on_frame
+        self.t_ns = 0
+        self.next_frame_ns = 0
+
+    def now_ns(self) -> int:
+        return self.t_ns
+
+    def advance(self, target_ns: int) -> None:
+        while self.next_frame_ns <= target_ns:
+            if self.end_ns is not None and self.next_frame_ns >= self.end_ns:
+                raise ClockFinished()
+            self.t_ns = self.next_frame_ns
+            if self.on_frame is not None:
+                self.on_frame(self.t_ns)
+            self.next_frame_ns += self.period_ns
+        self.t_ns = max(self.t_ns, target_ns)
+
+    def sleep_until_ns(self, t_ns: int, cancelled = lambda: False, wake = None) -> None:
+        if cancelled():
+            raise PatternCancelled()
+        self.advance(t_ns)
 
 
 # background 
@@ -396,28 +1539,51 @@ def transmitter_server(state: LightCurveState, terminate: Event):
 
     xmit = LightCurveTransmitter(state)
 
-    delay = 1.0 / state.args.fps
+    scheduler = FrameScheduler(state.args.fps, state.args.spin, state.frame_stats)
+    last_warning = 0.0
     # print(f'delay is {delay} fps is {xmit.fps}')
     try:
         while not terminate.is_set():
-            t1 = time()
+
+            # packets due between frames go out on time, up to the next frame. A pattern scheduling
+            # a solenoid edge wakes this up, in case it's due before then
+            while True:
+                deadline_ns = scheduler.next_deadline_ns() - EDGE_WAKE_NS
+                due_ns = xmit.next_due_ns()
+                wake_ns = deadline_ns if due_ns is None else min(due_ns, deadline_ns)
+                wait_ns = wake_ns - monotonic_ns()
+                if wait_ns > 0 and state.edges.wake.wait(wait_ns / 1_000_000_000):
+                    state.edges.wake.clear()
+                    continue
+                if wake_ns == deadline_ns:
+                    break
+                xmit.send_due(monotonic_ns())
+
+            if scheduler.wait() and time() > last_warning + 1.0:
+                print(f'transmit server cant keep up: {FrameScheduler.read_stats(state.frame_stats)}')
+                last_warning = time()
+            state.xmit_metrics.add('jitter', scheduler.last_late_ns)
 
             xmit.transmit()
 
             # a bit of a hack to put it here, should have its own thread or process, sorry so lazy
             state.nozzle_button_timeout_check()
 
-            d = delay - (time() - t1)
-            if (d > 0.002):
-                sleep(d)
-
     except KeyboardInterrupt:
         pass
 
     print(f'transmit server: turning off gas')
+    # make sure the live arrays are what's sent, not a committed frame, and no edges
+    state.frames.reset()
+    xmit.edges.clear()
     state.fill_apertures(0.0)
     state.fill_solenoids(0)
     xmit.transmit()
+    # and its edge repeats, that one matters most
+    xmit.send_due_until()
+    xmit.close()
+    print(f'transmit server: frame stats {FrameScheduler.read_stats(state.frame_stats)}')
+    print(f'transmit server: packets {dict(zip(TransmitMetrics.COUNTERS, state.xmit_metrics.counters[:]))}')
     sleep(0.1)
 
 def transmitter_server_init(state: LightCurveState):
@@ -450,6 +1616,26 @@ def transmitter_server_shutdown():
 # Like the other classes here, this will run in its own process and
 # read from the shared memory in the LightCurveState
 #
+# There are two formats, chosen with --status-format. JSON (version "1.0") is
+# the original. The binary one is fixed layout, a lot smaller and cheaper to build,
+# little endian:
+#
+#   4 bytes  'LCST'
+#   1 byte   version (2)
+#   1 byte   flags (0)
+#   2 bytes  command port
+#   4 bytes  uptime in milliseconds
+#   4 bytes  sequence
+#   4 bytes  solenoid mask, bit n is nozzle n (with the buttons applied)
+#   1 byte   number of nozzles
+#   n bytes  apertures, 0 .. 255 for 0.0 .. 1.0
+#
+# A receiver tells them apart by the magic, and checks the version byte.
+#
+
+STATUS_BINARY_MAGIC = b'LCST'
+STATUS_BINARY_VERSION = 2
+STATUS_BINARY_HEADER = '<4sBBHIIIB'
 
 
 class LightCurveStatusXmit:
@@ -491,50 +1677,70 @@ class LightCurveStatusXmit:
                 self.address = bs[0]
         print(f' StatusXmit on address {self.address}')
 
+        self.format = state.args.status_format
+        if self.format == 'binary' and state.nozzles > 32:
+            print(f' StatusXmit: binary status holds 32 solenoids, have {state.nozzles}, sending json')
+            self.format = 'json'
+
+        # the binary packet is allocated once, see STATUS_BINARY_HEADER
+        header_len = struct.calcsize(STATUS_BINARY_HEADER)
+        self.packet = bytearray(header_len + state.nozzles)
+        self.packet_apertures = np.frombuffer(self.packet, dtype=np.uint8, offset=header_len)
+        self.mask_bits = np.array([ 1 << i for i in range(min(state.nozzles, 32)) ], dtype=np.uint64)
+
 
     # call each time
     def transmit(self) -> None:
 
         print(f'status transmit') if self.debug else None
 
-        # build a data structure that has the info we'er interesting in
-        # it would be good to round all the floats to save data
+        if self.format == 'binary':
+            self.transmit_binary()
+        else:
+            self.transmit_json()
+
+    # the frame as the controllers see it: what the transmitter last sent, with the solenoid edges,
+    # interpolated apertures and the buttons overlaid. Before it has sent anything, the pattern's frame
+    def frame(self):
+
+        frame = self.state.sent_frames.read()
+        if frame is not None:
+            return frame[0], frame[1]
 
         # take a copy of the shared array for performance
-        nozzle_buttons = self.state.s.nozzle_buttons[:]
-        nozzle_buttons_1 = self.state.s.nozzle_buttons_1[:]
-        apertures = self.state.s.apertures[:]
-        solenoids = self.state.s.solenoids[:]
+        apertures, solenoids = self.state.current_frame()
+
+        # bad form. Should abstract out this instead of replicating it.
+        if not self.state.args.nobuttons:
+            buttons = self.state.snapshot('nozzle_buttons') | self.state.snapshot('nozzle_buttons_1')
+            solenoids = np.where(buttons[:self.state.nozzles], True, solenoids)
+
+        return apertures, solenoids
 
-        # THIS NEEDS TO BE MORE EFFICIENT!
+    def transmit_json(self) -> None:
+
+        # build a data structure that has the info we'er interesting in
+        # it would be good to round all the floats to save data
+
+        apertures, solenoids = self.frame()
 
         data = {
             "device": "lightcurve",
             "version": "1.0",
             "command_port": int(COMMAND_PORT),
             "uptime": round(time() - self.start_time,3), # don't take up too much bandwidth
-            "solenoids": solenoids, # take a copy for transmission
-            "apertures": [round(item,3) for item in apertures],
+            "solenoids": solenoids.tolist(), # take a copy for transmission
+            "apertures": np.round(apertures, 3).tolist(),
 # save a little perf
 #            "gyro": [round(item,3) for item in self.state.s.gyro[:]],
 #            "rotation": [round(item,3) for item in self.state.s.rotation[:]],
 #            "gravity": [round(item,3) for item in self.state.s.gravity[:]],
             "seq": self.sequence # allows estimation of packet loss
         }
+        if self.state.args.status_metrics:
+            data["metrics"] = self.state.xmit_metrics.brief(self.state.frame_stats)
         self.sequence += 1
 
-        # bad form. Should abstract out this instead of replicating it.
-        #if not self.state.args.nobuttons:
-        #    for n in range(self.state.args.nozzles):
-        #        if ((self.state.s.nozzle_buttons[n]) or (self.state.s.nozzle_buttons_1[n])):
-        #            data['solenoids'][n] = True
-
-        # bad form. Should abstract out this instead of replicating it.
-        if not self.state.args.nobuttons:
-            for n in range(self.state.args.nozzles):
-                if ((nozzle_buttons[n]) or (nozzle_buttons_1[n])):
-                    data['solenoids'][n] = True
-
         # the separators command greatly decreases the size by removing unnecessary spaces
         # slightly better code would also round the values in floating point to only 2 figures,
         # this is done with a custom encoder, you can look it up TODO
@@ -547,6 +1753,18 @@ class LightCurveStatusXmit:
         # print(f' sending status packets to: {self.address} {self.port} ')
         self.sock.sendto(byte_data,(self.address,self.port))
 
+    def transmit_binary(self) -> None:
+
+        apertures, solenoids = self.frame()
+
+        mask = int(np.dot(solenoids.astype(bool), self.mask_bits))
+        uptime_ms = int((time() - self.start_time) * 1000) & 0xffffffff
+        struct.pack_into(STATUS_BINARY_HEADER, self.packet, 0, STATUS_BINARY_MAGIC, STATUS_BINARY_VERSION, 0,
+            COMMAND_PORT, uptime_ms, self.sequence & 0xffffffff, mask, self.state.nozzles)
+        self.packet_apertures[:] = np.clip(np.rint(apertures * 255.0), 0, 255)
+        self.sequence += 1
+
+        self.sock.sendto(self.packet, (self.address, self.port))
 
 
 # background 
@@ -554,29 +1772,40 @@ class LightCurveStatusXmit:
 # see comment about state, it is a cross process shared object.
 # this function is a separate process
 
+# Status is sent when the frame changes, not at a fixed rate: the transmitter sets status_event when
+# what it sends changes, and this wakes up and sends right away. Bursts of changes are coalesced to
+# at most status fps. When nothing changes, a heartbeat goes out every --status-heartbeat seconds so
+# receivers know we're alive (the launchpad gives up after 3 seconds).
+
 def status_xmit_server(state: LightCurveState):
 
     xmit = LightCurveStatusXmit(state)
 
-    # delay = 1.0 / state.args.fps
-
-    # going to hardcode to 5 fps for now
-    delay = 1.0 / 5.0
+    # json is expensive, so it's slow by default. binary can keep up with the transmitter.
+    if state.args.status_fps is not None:
+        delay = 1.0 / state.args.status_fps
+    elif xmit.format == 'binary':
+        delay = 1.0 / state.args.fps
+    else:
+        delay = 1.0 / 5.0
+    heartbeat = state.args.status_heartbeat
 
-    # print(f'delay is {delay} fps is {xmit.fps}')
+    last_send = 0.0
     try:
         while True:
-            t1 = time()
 
-            xmit.transmit()
+            changed = state.status_event.wait(max(0.0, last_send + heartbeat - monotonic()))
 
-            d = delay - (time() - t1)
-            if (d > 0.002):
-                sleep(d)
-            else:
-                print(f'status xmit server cant keep up: small pause anyway')
-                sleep(0.5)
+            if changed:
+                # coalesce: no more than one per delay
+                d = last_send + delay - monotonic()
+                if d > 0.0:
+                    sleep(d)
+                # clear before reading, a change while we're sending wakes us again
+                state.status_event.clear()
 
+            last_send = monotonic()
+            xmit.transmit()
 
     except KeyboardInterrupt:
         pass
@@ -644,29 +1873,31 @@ def osc_handler_all (address: str, fixed_args: List[Any], *vals):
 
 # specific handlers good for efficiency
 def osc_handler_gyro(address: str, fixed_args: List[Any], *vals):
-    print(f' osc: gyro {vals}') if state.debug else None
     state = fixed_args[0]
+    print(f' osc: gyro {vals}') if state.debug else None
     if len(vals) != 3:
         return
-    state.s.gyro[:] = vals
+    state.imu_write(gyro=vals)
  
 def osc_handler_rotation(address: str, fixed_args: List[Any], *vals):
-    print(f' osc: rotation {vals}') if state.debug else None
     state = fixed_args[0]
+    print(f' osc: rotation {vals}') if state.debug else None
     if len(vals) != 3:
         return
-    state.s.rotation[:] = vals
+    state.imu_write(rotation=vals)
 
 def osc_handler_gravity(address: str, fixed_args: List[Any], *vals):
-    print(f' osc: gravity {vals}') if state.debug else None
     state = fixed_args[0]
+    print(f' osc: gravity {vals}') if state.debug else None
     if len(vals) != 3:
         return
-    state.s.gravity[:] = vals
+    state.imu_write(gravity=vals)
 
 # imu order
 # miliseconds int
 # rotation, gravity, gyro
+#
+# all of it goes into the IMU slot in one write
 
 def osc_handler_imu(address: str, fixed_args: List[Any], *vals):
     # print(f'handler received IMU: time {vals[0]} rot {vals[1:4]}, grav {vals[4:7]}, gyro {vals[7:10]} ') if state.debug else None
@@ -674,11 +1905,9 @@ def osc_handler_imu(address: str, fixed_args: List[Any], *vals):
         print(f'IMU: wrong number parameters should be 10 is: {len(vals) }')
         return
     state = fixed_args[0]
-    state.s.rotation[:] = vals[1:4]
     # Need to shuffle the gravity vector around based on the way it's oriented on the sculpture
     g = vals[4:7]
-    state.s.gravity[:] = [g[0], -g[1], -g[2]]
-    state.s.gyro[:] = vals[7:10]
+    state.imu_write(vals[0], vals[1:4], [g[0], -g[1], -g[2]], vals[7:10])
     #print(f'OSC IMU: rot {vals[1]:.4f}, {vals[2]:.4f}, {vals[3]:.4f}, grav {vals[4]:.4f}, {vals[5]:.4f}, {vals[6]:.4f} gyro {vals[7]:.4f}, {vals[8]:.4f}, {vals[9]:.4f}  ') if state.debug else None
     #print(f'OSC IMU: rot {vals[1]:.4f}, {vals[2]:.4f}, {vals[3]:.4f}, grav {vals[4]:.4f}, {vals[5]:.4f}, {vals[6]:.4f} gyro {vals[7]:.4f}, {vals[8]:.4f}, {vals[9]:.4f}  ') 
 
@@ -785,74 +2014,173 @@ def osc_server_init(state: LightCurveState, args):
 # I'm just tossing in some HTTP and JSON. There are too many options, so I'm going
 # with the endpoint 'flamatik', and all the rest of the data in the json.
 
-class CommandHTTPServer(HTTPServer):
-    def __init__(self, server_address, RequestHandlerClass, state: LightCurveState):
-        print(f'CommandHTTPServer: server address {server_address}')
-        super().__init__(server_address, RequestHandlerClass)
-        self.lc_state = state
-
-class CommandHandler(BaseHTTPRequestHandler):
-
-    def do_POST(self):
-        # print(f' post receved from {self.path} ')
-        parsed_url = urlparse(self.path)
-        # print(f' received post to path {parsed_url.path}')
-        if parsed_url.path != '/flamatik':
-            print(f' recevied command for incorrect endpoint')
-            self.send_error(400, "wrong path")
-            return
+#
+# This is a small asyncio HTTP/1.1 server, so one process can hold several connections, keep them
+# alive (the launchpad keeps one open), and answer a command once flamatik_execute has dealt with it:
+#
+#   POST /flamatik   {"command": "setPattern", "name": ...}  ->  {"accepted": true}
+#
+# The command goes on state.command_queue with a reply_id, and flamatik_execute answers on
+# state.command_replies. accepted is false if it turned the command down (e.g. no such pattern),
+# with a reason, and null if it didn't answer within COMMAND_REPLY_TIMEOUT (the command is still queued).
+#
+# GET /flamatik returns a histogram of how long commands took to be answered. Commands that
+# timed out are counted separately, as 'timeouts'.
+# GET /metrics returns that and the transmitter's metrics (see TransmitMetrics).
+#
 
-        content_length = int(self.headers['Content-length'])
-        post_data = self.rfile.read(content_length)
+COMMAND_REPLY_TIMEOUT = 0.1
+COMMAND_MAX_BODY = 64 * 1024
 
-        status = 400 # bad request
+# upper bounds of the latency histogram buckets, milliseconds
+LATENCY_BUCKETS_MS = [ 1, 2, 5, 10, 20, 50, 100, 200, 500 ]
 
-        try:
-            data = json.loads(post_data.decode('utf-8'))
-            print(f' received json command at {self.path} :: {data}')
+class LatencyHistogram:
 
-            self.server.lc_state.command_queue.put(data)
-            status = 200
+    def __init__(self, buckets = LATENCY_BUCKETS_MS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.timeouts = 0
 
-            # would be nice to return a status but then that would be synchronous.
-            # could probably have a validate....
+    def add(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
 
-            # build a response put it in json_response
-            #json_response = ""
-            #json_bytes = json.dumps(json_response).encode('utf-8')
-            #response = ( f"HTTP/1.1 {status} OK\r\n"
-            #            "Content-type: application/json\r\n"
-            #            f'Content-length: {len(json_bytes)}\r\n\r\n'
-            #            ).encode('utf-8') + json_bytes
+    # one that took longer than we waited, so we don't know how long
+    def timeout(self) -> None:
+        self.timeouts += 1
 
-            response = ( f"HTTP/1.1 {status} OK\r\n"
-                        "Content-type: application/json\r\n"
-                        f'Content-length: 0\r\n\r\n'
-                    ).encode('utf-8')
+    def to_dict(self) -> Dict[str, int]:
+        labels = [ f'<={b}' for b in self.buckets ] + [ f'>{self.buckets[-1]}' ]
+        r = dict(zip(labels, self.counts))
+        r['timeouts'] = self.timeouts
+        return r
 
 
-            self.wfile.write(response)
+class CommandServer:
 
-        except json.JSONDecodeError:
-            print('Data is not JSON')
-            self.send_error(400, "bad content object") # bad request
-            return
+    def __init__(self, port: int, state: LightCurveState) -> None:
+        self.port = port
+        self.state = state
+        self.latency = LatencyHistogram()
+        self.pending = {}
+        self.ids = itertools.count(1)
+
+    async def serve(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        # replies from flamatik_execute come back on a multiprocessing queue, which blocks,
+        # so a thread waits on it and hands them to the waiting requests
+        Thread(target=self.reply_reader, daemon=True).start()
+        server = await asyncio.start_server(self.connection, '', self.port)
+        print(f'CommandServer: listening on port {self.port}')
+        async with server:
+            await server.serve_forever()
+
+    def reply_reader(self) -> None:
+        while True:
+            reply_id, accepted, reason = self.state.command_replies.get()
+            future = self.pending.pop(reply_id, None)
+            if future is not None:
+                self.loop.call_soon_threadsafe(self.resolve, future, (accepted, reason))
 
-    def do_GET(self):
-        print(f' received get URI {self.path} which we dont support')
-        # parsed_url = urlparse(self.path)
+    @staticmethod
+    def resolve(future, result) -> None:
+        if not future.done():
+            future.set_result(result)
 
-        status = 404
-        response = ( f"HTTP/1.1 {status} OK\r\n\r\n").encode('ascii') + json_bytes
+    async def connection(self, reader, writer) -> None:
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, path, version, headers, body = request
+
+                status, response = await self.handle(method, path, body)
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                response_bytes = json.dumps(response).encode('utf-8')
+                writer.write(( f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                            "Content-type: application/json\r\n"
+                            f"Content-length: {len(response_bytes)}\r\n"
+                            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                            ).encode('ascii') + response_bytes)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            print(f' command server: dropping connection: {e}')
+        finally:
+            writer.close()
+
+    # returns (method, path, version, headers, body), or None if the connection closed
+    async def read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        method, path, version = line.decode('ascii').split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            k, _, v = line.decode('latin-1').partition(':')
+            headers[k.strip().lower()] = v.strip()
+        length = int(headers.get('content-length', 0))
+        if length > COMMAND_MAX_BODY:
+            raise ValueError(f'body too long {length}')
+        body = await reader.readexactly(length) if length else b''
+        return method, path, version, headers, body
+
+    async def handle(self, method: str, path: str, body: bytes):
+
+        if method == 'GET' and urlparse(path).path == '/metrics':
+            return 200, { 'transmit': self.state.xmit_metrics.summary(self.state.frame_stats),
+                          'commands': { 'latency_ms': self.latency.to_dict() } }
+
+        if urlparse(path).path != '/flamatik':
+            print(f' recevied command for incorrect endpoint {path}')
+            return 400 if method == 'POST' else 404, { 'error': 'wrong path' }
+
+        if method == 'GET':
+            return 200, { 'latency_ms': self.latency.to_dict() }
+
+        if method != 'POST':
+            return 405, { 'error': 'method not allowed' }
 
-        self.wfile.write(response)
+        t1 = monotonic()
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            print('Data is not JSON')
+            return 400, { 'error': 'bad content object' }
+        if not isinstance(data, dict):
+            return 400, { 'error': 'bad content object' }
+        print(f' received json command at {path} :: {data}')
+
+        # ask flamatik_execute, and wait a little for it to say if it took it
+        reply_id = next(self.ids)
+        future = self.loop.create_future()
+        self.pending[reply_id] = future
+        data['reply_id'] = reply_id
+        self.state.command_queue.put(data)
+        try:
+            accepted, reason = await asyncio.wait_for(future, COMMAND_REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.pending.pop(reply_id, None)
+            self.latency.timeout()
+            return 200, { 'accepted': None }
+
+        self.latency.add((monotonic() - t1) * 1000.0)
+        response = { 'accepted': accepted }
+        if reason:
+            response['reason'] = reason
+        return 200, response
 
 
 def command_server(port:int, state: LightCurveState):
     print(f'command server process: port {port}')
     try:
-        httpd = CommandHTTPServer(('', port), CommandHandler, state)
-        httpd.serve_forever()
+        asyncio.run(CommandServer(port, state).serve())
     except KeyboardInterrupt:
         pass
     print(f' command server terminating')
@@ -903,24 +2231,156 @@ def print_bytearray(b: bytearray) -> None:
             o += 1
 
 # Dynamically import patterns
+#
+# Patterns are found by their file names, pattern_NAME.py holding a function or class pattern_NAME,
+# and a module is only imported when the pattern is first run, or asked for with PATTERN_FUNCTIONS[name].
+# Importing all of them took long enough on the Pi to matter after a crash and restart. Since patterns
+# run in the pattern workers, that is where they're imported, and idle workers import the next playlist
+# entry ahead of time (see pattern_preload).
+#
+# Pattern files can be edited while flamatik runs. pattern_watcher notices new and changed files, and
+# the workers re-import changed modules before they next run them. A module that fails to import, or
+# no longer has its pattern, is reported and the old version kept.
+#
 
-def import_patterns():
-    global PATTERN_FUNCTIONS
-    PATTERN_FUNCTIONS = {}
+class PatternRegistry:
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.modules = {}      # pattern name -> module name, for the ones in files
+        self.functions = {}    # pattern name -> function or class, once imported or inserted
+        self.import_ns = {}    # module name -> nanoseconds its import took
+        self.mtimes = {}       # module name -> modification time of the file when it was imported
+        self.sleep = None      # what `sleep` is in pattern modules, if not time.sleep
+
+    # returns the names of patterns that weren't known before
+    def discover(self) -> List[str]:
+        modules = {}
+        for fn in sorted(glob.glob(f'{self.directory}/pattern_*.py')):
+            module_name = os.path.splitext(os.path.basename(fn))[0]
+            modules[module_name.split('_',1)[1]] = module_name
+        new = [ name for name in modules if name not in self.modules ]
+        self.modules = modules
+        return new
+
+    def mtime(self, module_name: str):
+        try:
+            return os.path.getmtime(os.path.join(self.directory, f'{module_name}.py'))
+        except OSError:
+            return None
 
-    # kinda shitty but just add the directory with this file to the path and remove it again
-    sys.path.append(os.path.dirname(__file__))
+    def insert(self, name: str, fn) -> None:
+        self.functions[name] = fn
+
+    def load(self, name: str):
+        module_name = self.modules[name]
+
+        # kinda shitty but just add the directory with this file to the path and remove it again
+        sys.path.append(self.directory)
+        try:
+            # patterns `import flamatik`, which where this file is __main__ is a second copy of it. Import
+            # that first, so the first pattern's time doesn't include it
+            importlib.import_module('flamatik')
+            self.mtimes[module_name] = self.mtime(module_name)
+            t1 = monotonic_ns()
+            module = importlib.import_module(module_name)
+            self.import_ns[module_name] = monotonic_ns() - t1
+        finally:
+            sys.path.remove(self.directory)
+        print(f' imported {module_name} in {self.import_ns[module_name] / 1_000_000:.1f} ms')
+
+        self.patch_sleep(module)
+        self.functions[name] = getattr(module, module_name)
+        return self.functions[name]
+
+    # re-import the module of a pattern. The file is run in a new module, and it only replaces the old
+    # one if that works and has the pattern: importlib.reload would run it in the old module, and one that
+    # fails partway leaves the old pattern with half of the new globals (and `sleep` back to time.sleep).
+    # If it fails, say so and keep the one we had.
+    def reload(self, name: str) -> bool:
+        module_name = self.modules[name]
+
+        sys.path.append(self.directory)
+        try:
+            self.mtimes[module_name] = self.mtime(module_name)
+            t1 = monotonic_ns()
+            spec = importlib.util.spec_from_file_location(module_name, os.path.join(self.directory, f'{module_name}.py'))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            fn = getattr(module, module_name, None)
+            if not callable(fn):
+                raise TypeError(f'{module_name} has no function or class {module_name}')
+            reload_ns = monotonic_ns() - t1
+        except Exception:
+            print(f' ERROR reloading {module_name}, keeping the previous version')
+            traceback.print_exc()
+            if module_name in sys.modules:
+                self.patch_sleep(sys.modules[module_name])
+            return False
+        finally:
+            sys.path.remove(self.directory)
+        print(f' reloaded {module_name} in {reload_ns / 1_000_000:.1f} ms')
 
-    dir_path = f'{os.path.dirname(__file__)}/pattern_*.py'
-    for fn in glob.glob(dir_path):
+        sys.modules[module_name] = module
+        self.patch_sleep(module)
+        self.functions[name] = fn
+        return True
 
-        pattern_name = os.path.splitext(os.path.basename(fn))[0]
-        pattern_functionname = pattern_name.split('_',1)[1]
-        # print(f'importing pattern name {pattern_functionname} in file {pattern_name}')
-        module = importlib.import_module(pattern_name)
-        PATTERN_FUNCTIONS[pattern_functionname] = getattr(module,pattern_name)
+    # reload the imported patterns whose files changed since, or just the one asked for
+    def refresh(self, name: str = None) -> None:
+        for n in ([ name ] if name is not None else list(self.functions)):
+            module_name = self.modules.get(n)
+            if module_name is not None and n in self.functions and self.mtime(module_name) != self.mtimes.get(module_name):
+                self.reload(n)
 
-    sys.path.remove(os.path.dirname(__file__))
+    def loaded(self, name: str) -> bool:
+        return name in self.functions
+
+    # point `sleep` in the pattern modules, imported already or later, at fn
+    def set_sleep(self, fn) -> None:
+        self.sleep = fn
+        for module_name in self.modules.values():
+            if module_name in sys.modules:
+                self.patch_sleep(sys.modules[module_name])
+
+    def patch_sleep(self, module) -> None:
+        if self.sleep is not None and getattr(module, 'sleep', None) is sleep:
+            module.sleep = self.sleep
+
+    # enough of a dict for the rest of flamatik
+    def __contains__(self, name: str) -> bool:
+        return name in self.modules or name in self.functions
+
+    def __getitem__(self, name: str):
+        if name in self.functions:
+            return self.functions[name]
+        return self.load(name)
+
+    def keys(self) -> List[str]:
+        return list(self.modules) + [ name for name in self.functions if name not in self.modules ]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    # imports everything
+    def items(self):
+        return [ (name, self[name]) for name in self.keys() ]
+
+    def values(self):
+        return [ self[name] for name in self.keys() ]
+
+
+PATTERN_FUNCTIONS = PatternRegistry(os.path.dirname(os.path.abspath(__file__)))
+
+def import_patterns():
+    global PATTERN_FUNCTIONS
+    PATTERN_FUNCTIONS = PatternRegistry(os.path.dirname(os.path.abspath(__file__)))
+    PATTERN_FUNCTIONS.discover()
+
+    pattern_insert('multipattern', pattern_multipattern)
 
 # load all the modules (files) which contain patterns
 
@@ -929,8 +2389,18 @@ def patterns():
 
 PATTERN_PARAMETERS = [ "nozzle", "delay", "group", "spins", "frame_delay" ]
 
+# overwrite the values in args with pattern properties
+# later todo: change all patterns to look at the pattern_object
+def pattern_args(pattern_o: Dict, state) -> None:
+    for param in PATTERN_PARAMETERS:
+        if param in pattern_o:
+            # print(f'Found {param} replacing with {pattern_o[param]}')
+            setattr(state.args, param, pattern_o[param])
+        else:
+            setattr(state.args, param, None)
+
 # object 
-def pattern_execute(pattern_o: Dict, state) -> Process:
+def pattern_execute(pattern_o: Dict, state):
 
     # print(f'pattern execute: {pattern_o}')
 
@@ -938,21 +2408,12 @@ def pattern_execute(pattern_o: Dict, state) -> Process:
     if pattern_name not in PATTERN_FUNCTIONS:
         return None 
 
-    # overwrite the values in args with pattern properties
-    # later todo: change all patterns to look at the pattern_object
-    for param in PATTERN_PARAMETERS:
-        if param in pattern_o:
-            # print(f'Found {param} replacing with {pattern_o[param]}')
-            setattr(state.args, param, pattern_o[param])
-        else:
-            setattr(state.args, param, None)
-
-    pattern_process = Process(target=PATTERN_FUNCTIONS[pattern_name], args=(state,) )
-    return pattern_process
+    # patterns run in the pattern workers, which are already running
+    return PatternHandle(pattern_o, state)
 
 
 def pattern_insert(pattern_name: str, pattern_fn):
-    PATTERN_FUNCTIONS[pattern_name] = pattern_fn
+    PATTERN_FUNCTIONS.insert(pattern_name, pattern_fn)
 
 
 
@@ -961,14 +2422,305 @@ def pattern_multipattern(state: LightCurveState):
     print(f'Starting multipattern pattern')
 
     for _ in range(state.args.repeat):
-        for name, fn in PATTERN_FUNCTIONS.items():
+        for name in PATTERN_FUNCTIONS.keys():
             if name != 'multipattern':
-                if fn(state): # check if pattern returns false for error, if so return error too
+                fn = PATTERN_FUNCTIONS[name]
+                state.frames.reset()
+                if is_frame_pattern(fn):
+                    frame_pattern_run(fn, state)
+                elif fn(state): # check if pattern returns false for error, if so return error too
                     return False
 
     print(f'Ending multipattern pattern')
 
 
+#
+# Frame patterns
+#
+# The classic pattern is a function that sets the state and calls sleep(), and runs in a process
+# of its own, started for every playlist entry and every repeat. On a Pi 3B that start costs
+# hundreds of milliseconds.
+#
+# A frame pattern instead says what each frame looks like, and is stepped by the pattern runtime,
+# a single process that lives as long as flamatik does, in step with the transmitter's frame clock.
+# Each frame is committed (see FrameBuffer), half a frame before the transmitter sends it.
+# Switching between patterns is just handing the workers a new job.
+#
+# There are two ways of writing one. A generator, where each yield ends a frame, and receives
+# the time since the pattern started and the time since the last frame, in seconds:
+#
+#   def pattern_example(state: ft.LightCurveState):
+#       state.fill_solenoids(1)
+#       t = 0.0
+#       while t < 10.0:
+#           state.fill_apertures(t / 10.0)
+#           t, dt = yield
+#
+# yield a number to wait that many frames instead of one. Or a class with a render method, which
+# returns False when the pattern is done (and an optional start method):
+#
+#   class pattern_example:
+#       def start(self, state):
+#           state.fill_solenoids(1)
+#       def render(self, t, dt, state) -> bool:
+#           state.fill_apertures(t / 10.0)
+#           return t < 10.0
+#
+# Classic patterns run in the same workers (see below), and stop when they next sleep().
+#
+
+def is_frame_pattern(fn) -> bool:
+    return inspect.isgeneratorfunction(fn) or hasattr(fn, 'render')
+
+def _render_steps(pattern, state: LightCurveState):
+    if hasattr(pattern, 'start'):
+        pattern.start(state)
+    t, dt = 0.0, 0.0
+    while pattern.render(t, dt, state) is not False:
+        t, dt = yield
+
+def frame_pattern_steps(fn, state: LightCurveState):
+    if inspect.isgeneratorfunction(fn):
+        return fn(state)
+    return _render_steps(fn(), state)
+
+# step a frame pattern until it ends, or stop() returns true, which raises PatternCancelled like
+# state.sleep() does in a classic pattern. Frames are
+# rendered half a frame ahead of the transmitter's deadlines, if it is running.
+def frame_pattern_run(fn, state: LightCurveState, stop = None) -> None:
+
+    if stop is None:
+        stop = state.cancelled
+
+    scheduler = FrameScheduler(state.args.fps)
+    epoch_ns, period_ns = state.frame_stats[FrameScheduler.STATS.index('epoch_ns')], scheduler.period_ns
+    if epoch_ns:
+        scheduler.align(epoch_ns - period_ns // 2)
+    else:
+        scheduler.start()
+
+    steps = frame_pattern_steps(fn, state)
+    start_ns = monotonic_ns()
+    last_ns = start_ns
+    try:
+        wait = next(steps)
+        while True:
+            if stop():
+                raise PatternCancelled()
+            state.commit()
+            for _ in range(wait or 1):
+                scheduler.wait()
+            if stop():
+                raise PatternCancelled()
+            now = monotonic_ns()
+            wait = steps.send(((now - start_ns) / 1_000_000_000, (now - last_ns) / 1_000_000_000))
+            last_ns = now
+    except StopIteration:
+        if stop():
+            raise PatternCancelled()
+        state.commit()
+    finally:
+        steps.close()
+
+#
+# Pattern workers
+#
+# Patterns run in a pool of long-lived worker processes (--workers, PATTERN_WORKERS by default),
+# which take jobs from state.runtime_jobs one at a time. While one runs a pattern the others wait
+# on the queue, so the next pattern starts right away.
+#
+# Stopping is cooperative. runtime_ctl[RUNTIME_STOP] holds the id of the last job asked to stop,
+# state.cancelled() says if that's ours, and the worker's state.runtime_wake event wakes it. Then
+# state.sleep() (`sleep` in the pattern modules) and frame_pattern_run raise PatternCancelled, and
+# pattern_job closes the solenoids, unless a newer pattern is already running.
+#
+# runtime_ctl[RUNTIME_PRELOAD] counts requests to import state.preload (see pattern_preload), and
+# runtime_ctl[RUNTIME_RELOAD] the times pattern_watcher saw pattern files change. After
+# RUNTIME_SLOTS, each worker has two words: the last job it took, and the one it's running (0 if none).
+#
+
+RUNTIME_STOP = 0
+RUNTIME_PRELOAD = 1
+RUNTIME_RELOAD = 2
+RUNTIME_SLOTS = 3
+
+PATTERN_WORKERS = 2
+
+class PatternCancelled(Exception):
+    pass
+
+def _worker_taken(worker: int) -> int:
+    return RUNTIME_SLOTS + 2 * worker
+
+def _worker_running(worker: int) -> int:
+    return RUNTIME_SLOTS + 2 * worker + 1
+
+# Handle on a job in the workers, that looks enough like a Process for flamatik_execute.
+
+class PatternHandle:
+
+    ids = itertools.count(1)
+
+    def __init__(self, pattern_o: Dict, state: LightCurveState) -> None:
+        self.pattern_o = dict(pattern_o)
+        self.state = state
+        self.id = next(PatternHandle.ids)
+
+    def start(self) -> None:
+        self.state.runtime_jobs.put( (self.id, self.pattern_o) )
+
+    # alive until a worker has taken it and isn't running it any more. Jobs are taken in order,
+    # and a worker marks a job running before it marks it taken
+    def is_alive(self) -> bool:
+        ctl = self.state.runtime_ctl
+        if max(ctl[_worker_taken(w)] for w in range(self.state.workers)) < self.id:
+            return True
+        return any(ctl[_worker_running(w)] == self.id for w in range(self.state.workers))
+
+    # the stop goes first: a worker marks the job running before it checks for it, so either it
+    # sees the stop or we see it running and wake it
+    def terminate(self) -> None:
+        ctl = self.state.runtime_ctl
+        ctl[RUNTIME_STOP] = self.id
+        for w in range(self.state.workers):
+            if ctl[_worker_running(w)] == self.id:
+                self.state.runtime_wake[w].set()
+
+    def join(self, timeout: float = 5.0) -> None:
+        end = time() + timeout
+        while self.is_alive() and time() < end:
+            sleep(0.001)
+
+
+# tell the idle workers to import a pattern, likely the next one, so it starts without the wait
+def pattern_preload(state: LightCurveState, name: str) -> None:
+    if name in PATTERN_FUNCTIONS and not PATTERN_FUNCTIONS.loaded(name):
+        state.preload.value = name.encode('utf-8')[:len(state.preload) - 1]
+        state.runtime_ctl[RUNTIME_PRELOAD] += 1
+
+# background. a thread in the main process, that looks at the pattern files' modification times
+# every interval seconds, adds new patterns, and tells the workers when there are changes
+
+PATTERN_WATCH_INTERVAL = 1.0
+
+def pattern_watcher(state: LightCurveState, interval: float = PATTERN_WATCH_INTERVAL):
+    registry = PATTERN_FUNCTIONS
+    mtimes = { m: registry.mtime(m) for m in registry.modules.values() }
+    while True:
+        sleep(interval)
+        new = registry.discover()
+        if new:
+            print(f' pattern watcher: new patterns {" ".join(new)}')
+            mtimes.update({ registry.modules[name]: registry.mtime(registry.modules[name]) for name in new })
+        changed = [ m for m in registry.modules.values() if registry.mtime(m) != mtimes.get(m) ]
+        if changed:
+            print(f' pattern watcher: changed {" ".join(changed)}')
+            mtimes.update({ m: registry.mtime(m) for m in changed })
+            state.runtime_ctl[RUNTIME_RELOAD] += 1
+
+def pattern_watcher_init(state: LightCurveState):
+    Thread(target=pattern_watcher, args=(state,), daemon=True).start()
+
+def pattern_run(fn, state: LightCurveState) -> None:
+    if is_frame_pattern(fn):
+        frame_pattern_run(fn, state)
+    else:
+        fn(state)
+
+# run a job's pattern in a worker. Stopped, of either style, it closes the solenoids it left open, and
+# goes back to the live arrays in case it committed them, unless a newer pattern is already running
+def pattern_job(fn, state: LightCurveState, job_id: int) -> None:
+    ctl = state.runtime_ctl
+    try:
+        pattern_run(fn, state)
+    except PatternCancelled:
+        if not any(ctl[_worker_running(w)] > job_id for w in range(state.workers)):
+            state.frames.reset()
+            state.fill_solenoids(0)
+
+# background. this function is a separate process, one of the pattern workers
+
+def pattern_runtime(state: LightCurveState, terminate: Event, worker: int):
+
+    # where processes are spawned rather than forked, this is a fresh copy of this file
+    if not PATTERN_FUNCTIONS:
+        import_patterns()
+    PATTERN_FUNCTIONS.set_sleep(state.sleep)
+    preload_seq = 0
+    reload_seq = 0
+    ctl = state.runtime_ctl
+    state.wake = state.runtime_wake[worker]
+
+    try:
+        while not terminate.is_set():
+            try:
+                job_id, pattern_o = state.runtime_jobs.get(timeout=0.1)
+            except queue.Empty:
+                # reload what changed while we're idle, so it doesn't hold up the next start
+                if reload_seq != ctl[RUNTIME_RELOAD]:
+                    reload_seq = ctl[RUNTIME_RELOAD]
+                    PATTERN_FUNCTIONS.discover()
+                    PATTERN_FUNCTIONS.refresh()
+                if preload_seq != ctl[RUNTIME_PRELOAD]:
+                    preload_seq = ctl[RUNTIME_PRELOAD]
+                    name = state.preload.value.decode('utf-8', errors='replace')
+                    if name in PATTERN_FUNCTIONS and not PATTERN_FUNCTIONS.loaded(name):
+                        print(f' pattern worker {worker}: preloading {name}')
+                        try:
+                            PATTERN_FUNCTIONS.load(name)
+                        except Exception:
+                            traceback.print_exc()
+                continue
+
+            state.wake.clear()
+            ctl[_worker_running(worker)] = job_id
+            ctl[_worker_taken(worker)] = job_id
+            state.job = job_id
+
+            # a job that was stopped before it got here doesn't run at all
+            if not state.cancelled():
+                print(f' pattern worker {worker}: starting {pattern_o["name"]}')
+                pattern_args(pattern_o, state)
+                if pattern_o['name'] not in PATTERN_FUNCTIONS:
+                    PATTERN_FUNCTIONS.discover()
+                PATTERN_FUNCTIONS.refresh(pattern_o['name'])
+                try:
+                    pattern_job(PATTERN_FUNCTIONS[pattern_o['name']], state, job_id)
+                except Exception:
+                    print(f' pattern worker {worker}: pattern {pattern_o["name"]} failed')
+                    traceback.print_exc()
+
+            state.job = 0
+            ctl[_worker_running(worker)] = 0
+            state.command_queue.put({ 'command': 'patternFinished', 'job': job_id })
+
+    except KeyboardInterrupt:
+        pass
+
+def pattern_runtime_init(state: LightCurveState):
+    global RUNTIME_PROCESSES, RUNTIME_TERMINATE_EVENT
+
+    print(f'pattern runtime init: {state.workers} workers')
+    RUNTIME_TERMINATE_EVENT = Event()
+    RUNTIME_PROCESSES = []
+    for worker in range(state.workers):
+        process = Process(target=pattern_runtime, args=(state, RUNTIME_TERMINATE_EVENT, worker) )
+        process.daemon = True
+        process.start()
+        RUNTIME_PROCESSES.append(process)
+
+def pattern_runtime_shutdown(state: LightCurveState):
+    global RUNTIME_PROCESSES, RUNTIME_TERMINATE_EVENT
+
+    # stop everything, queued or running
+    state.runtime_ctl[RUNTIME_STOP] = 2**62
+    for wake in state.runtime_wake:
+        wake.set()
+    RUNTIME_TERMINATE_EVENT.set()
+    for process in RUNTIME_PROCESSES:
+        process.join(1.0)
+
+
 # format of a JSON file which describes a playlist:
 # [ 
 #   { "name": "nameofpattern",
@@ -1031,6 +2783,19 @@ def flamatik_playlist_reset(args):
 
 
 
+# how long flamatik_execute waits for a command before checking on the pattern anyway
+EXECUTE_POLL = 0.1
+
+# ask a running pattern to stop, and give it a frame to do so. If it's slower than that the
+# next pattern starts anyway, in the other worker
+# the next pattern starts with the solenoids closed, whatever the stopped one left open
+def pattern_stop(pattern_process, state: LightCurveState) -> None:
+    if pattern_process is not None and pattern_process.is_alive():
+        pattern_process.terminate()
+        pattern_process.join(1.0 / state.args.fps)
+        state.fill_solenoids(0)
+
+
 # now there's an execute list. It could start out with
 # a pattern, or a playlist, but it listens on the command queue and switches patterns
 # if requested
@@ -1084,59 +2849,88 @@ def flamatik_execute(args, state: LightCurveState):
                 continue
 
             pattern_process = pattern_execute(p, state)
+            # a new pattern starts out sending the live arrays, until it commits
+            state.frames.reset()
             pattern_process.start()
+            pattern_preload(state, playlist[(playlist_index + 1) % len(playlist)]['name'])
 
-        # check the command queue, do something if we can
+        # wait for a command, the pattern finishing, or the end of its duration
+        timeout = EXECUTE_POLL
+        if pattern_end is not None:
+            timeout = min(max(pattern_end - time(), 0.0), EXECUTE_POLL)
         try:
-            msg = state.command_queue.get_nowait()
-            print(f' receieved command in execute: {msg}')
-            cmd = msg['command']
-            if cmd == 'setPattern':
-                print(f' set pattern received, changing pattern to {msg["name"]}')
-
-                # check that pattern exists
-
-                # replace the playlist with this
-                playlist = (msg,)
+            msg = state.command_queue.get(timeout=timeout)
+        except queue.Empty:
+            msg = None
+
+        # drain everything that's waiting, so a burst of commands ends up at the last
+        while msg is not None:
+            cmd = msg.get('command')
+            if cmd == 'patternFinished':
+                # from a worker. Only the pattern we're running matters, a stopped one finishing doesn't
+                if pattern_process is not None and msg.get('job') == pattern_process.id:
+                    pattern_process = None
 
-                # terminate what is running
-                if pattern_process.is_alive():
-                    pattern_process.terminate()
-                    pattern_process.join()
+            else:
+                print(f' receieved command in execute: {msg}')
+                reply_id = msg.pop('reply_id', None)
+                accepted, reason = True, None
+
+                if cmd == 'setPattern':
+                    print(f' set pattern received, changing pattern to {msg.get("name")}')
+
+                    # check that pattern exists, and keep playing what we've got if not
+                    if msg.get('name') not in PATTERN_FUNCTIONS:
+                        print(f' ERROR set pattern for pattern that does not exist: {msg.get("name")}')
+                        accepted, reason = False, 'no such pattern'
+                    else:
+                        # replace the playlist with this, and stop what is running
+                        playlist = (msg,)
+                        pattern_stop(pattern_process, state)
+                        pattern_process = None
+                        pattern_end = None
+                        playlist_index = -1
+                        playlist_reps = 1
+
+                elif cmd == 'resetPattern':
+
+                    print(f' reset pattern received, resetting to original pattern or playlist')
+
+                    playlist = flamatik_playlist_reset(args)
+                    pattern_stop(pattern_process, state)
                     pattern_process = None
                     pattern_end = None
                     playlist_index = -1
+                    playlist_reps = 1
 
-            elif cmd == 'resetPattern':
+                else:
+                    print(f' ERROR unknown command {cmd}')
+                    accepted, reason = False, 'unknown command'
 
-                print(f' reset pattern received, resetting to original pattern or playlist')
+                if reply_id is not None:
+                    state.command_replies.put((reply_id, accepted, reason))
 
-                playlist = flamatik_playlist_reset(args)
+            try:
+                msg = state.command_queue.get_nowait()
+            except queue.Empty:
+                msg = None
 
-                # terminate what is running
-                if pattern_process.is_alive():
-                    pattern_process.terminate()
-                    pattern_process.join()
-                    pattern_process = None
-                    pattern_end = None
-                    playlist_index = -1
-
-        except queue.Empty:
-            pass
-
-        # check the duration, kill if out of time
-        if pattern_end is not None and pattern_end < time():
+        # check the duration, stop it if out of time
+        if pattern_process is not None and pattern_end is not None and pattern_end < time():
             print(f' Ending pattern {p["name"]} end was {pattern_end}')
-            pattern_process.terminate()
-            pattern_process.join()
+            pattern_stop(pattern_process, state)
             pattern_process = None 
             pattern_end = None
 
-        sleep(0.01)
-
 #
 #
 
+def positive_float(s: str) -> float:
+    v = float(s)
+    if not v > 0:
+        raise argparse.ArgumentTypeError(f'{s} should be more than 0')
+    return v
+
 def args_init():
     parser = argparse.ArgumentParser(prog='flamatik', description='Send ArtNet packets to the Light Curve')
     parser.add_argument('--config','-c', type=str, default="lightcurve.cnf", help='Fire Art Controller configuration file')
@@ -1144,7 +2938,26 @@ def args_init():
     parser.add_argument('--pattern', '-p', default="pulse", type=str, help=f'pattern one of: {patterns()}')
     parser.add_argument('--address', '-a', default="0.0.0.0", type=str, help=f'address to listen OSC on defaults to broadcast on non-loop')
     parser.add_argument('--broadcast', '-b', default="", type=str, help='use a specific broadcast address to send status')
+    parser.add_argument('--status-format', default="json", choices=['json', 'binary'], help='format of the status broadcast')
+    parser.add_argument('--status-fps', type=float, help='most status broadcasts per second, default 5 for json, the transmit fps for binary')
+    parser.add_argument('--status-metrics', action='store_true', help='add a summary of the transmit metrics to the json status')
+    parser.add_argument('--status-heartbeat', default=1.0, type=float, help='seconds between status broadcasts when nothing changes')
     parser.add_argument('--fps', '-f', default=15, type=int, help='frames per second')
+    parser.add_argument('--artnet-keepalive', default=0.0, type=float, help="only send controllers changes, and a packet this many seconds apart when nothing changes. 0 sends every frame")
+    parser.add_argument('--edge-repeats', default=0, type=int, help="send frames where a solenoid changes this many extra times")
+    parser.add_argument('--edge-spacing', default=5.0, type=float, help="milliseconds between edge repeats")
+    parser.add_argument('--interpolate', default='none', type=str, help=f"smooth the apertures between pattern updates, one of {INTERPOLATIONS}")
+    parser.add_argument('--interpolate-max', default=0.5, type=float, help="longest an interpolated move takes, seconds")
+    parser.add_argument('--spin', action='store_true', help="busy wait the last millisecond of each frame for tighter frame timing (uses more CPU)")
+    parser.add_argument('--record', type=str, help="directory to record the frames sent to, see framelog.py")
+    parser.add_argument('--record-mb', default=16.0, type=float, help="size of each recording file in MB")
+    parser.add_argument('--record-files', default=8, type=int, help="number of recording files to keep, the oldest are deleted")
+    parser.add_argument('--replay', type=str, help="send a recording (a file, or a --record directory) instead of running patterns")
+    parser.add_argument('--replay-speed', default=1.0, type=positive_float, help="replay this many times faster than recorded")
+    parser.add_argument('--render', type=str, help="render the pattern to this file as fast as possible, instead of playing it")
+    parser.add_argument('--render-seconds', default=60.0, type=float, help="seconds of pattern to render")
+    parser.add_argument('--seed', type=int, help="seed the random number generators, for the same render every time")
+    parser.add_argument('--workers', default=PATTERN_WORKERS, type=int, help="number of pattern worker processes, at least 2")
     parser.add_argument('--repeat', '-r', default=9999, type=int, help="number of times to run pattern")
     parser.add_argument('--nobuttons',  action='store_true', help="add this if you want to disable the button function")
     parser.add_argument('--debug', action='store_true', help=" turn on the very verbose debugging all the things")
@@ -1164,6 +2977,7 @@ def args_init():
         args.controllers = conf['controllers']
         args.nozzles = conf['nozzles']
         args.aperture_calibration = conf['aperture_calibration']
+        args.state_backend = conf.get('state_backend', 'manager')
 
     return args
 
@@ -1173,17 +2987,17 @@ def args_init():
 def main():
 
     import_patterns()
-    pattern_insert('multipattern', pattern_multipattern)
 
     args = args_init()
     global debug
     debug = args.debug
 
-    if (args.list == "") and (args.pattern not in PATTERN_FUNCTIONS):
+    if not args.replay and (args.list == "") and (args.pattern not in PATTERN_FUNCTIONS):
         print(f' pattern must be one of {patterns()}')
         return
 
-    with Manager() as manager:
+    # the manager is only needed if the state lives in it
+    with Manager() if args.state_backend == 'manager' else nullcontext() as manager:
 
         try:
             state = LightCurveState(args, manager)
@@ -1191,10 +3005,26 @@ def main():
             print(f' Config file problem, exiting: {str(e)} ')
             return
 
+        # a render runs the pattern here, with nothing else
+        if args.render:
+            flamatik_render(args, state)
+            return
+
+        # a replay sends the recording itself, no patterns or transmitter
+        if args.replay:
+            status_xmit_server_init(state)
+            flamatik_replay(args, state)
+            sleep(0.5)
+            return
+
         # creates a transmitter background process that reads from the shared state
         # and sends to controllers (unicast)
         transmitter_server_init(state)
 
+        # the long lived processes that run patterns, and a watch on their files
+        pattern_runtime_init(state)
+        pattern_watcher_init(state)
+
         # create a status transmitter which broadcasts over the local network
         # some interesting information
 
@@ -1215,10 +3045,156 @@ def main():
 
         finally:
             print(f' in all cases, try to shutdown the transmitter safely')
+            pattern_runtime_shutdown(state)
             transmitter_server_shutdown()
             sleep(0.5)
 
 
+#
+# Replay. Sends a recording (see --record and framelog.py) to the controllers instead of running
+# patterns, through this config's mapping and calibration, with the timing it was recorded with
+# (sped up or slowed down by --replay-speed). The files are mapped and read in order, so a long
+# recording doesn't take more memory than a short one.
+#
+
+# gaps longer than this in a recording (flamatik was stopped) are cut down to it
+REPLAY_MAX_GAP = 2.0
+
+def flamatik_replay(args, state: LightCurveState) -> None:
+
+    files = framelog.framelog_files(args.replay) if os.path.isdir(args.replay) else [ args.replay ]
+    print(f'replay: {len(files)} files from {args.replay} at speed {args.replay_speed}')
+
+    xmit = LightCurveTransmitter(state)
+    deadline_ns = monotonic_ns()
+    last_ns = None
+    frames = 0
+
+    try:
+        for fn in files:
+            with framelog.FrameLogReader(fn) as reader:
+                if reader.nozzles != state.nozzles:
+                    print(f'replay: {fn} has {reader.nozzles} nozzles, config has {state.nozzles}, skipping')
+                    continue
+                print(f'replay: {fn} {len(reader)} frames')
+                for record in reader:
+                    if last_ns is not None:
+                        gap_ns = min(max(record['time_ns'] - last_ns, 0), int(REPLAY_MAX_GAP * 1_000_000_000))
+                        deadline_ns += int(gap_ns / args.replay_speed)
+                    last_ns = record['time_ns']
+
+                    apertures = framelog.dequantize_apertures(record['apertures'])
+                    solenoids = framelog.unpack_mask(record['solenoids'], reader.nozzles).astype(np.int32)
+                    buttons = framelog.unpack_mask(record['buttons'], reader.nozzles)
+
+                    # edge repeats of the frames before, then this one
+                    xmit.send_due_until(deadline_ns)
+                    wait_ns = deadline_ns - monotonic_ns()
+                    if wait_ns > 0:
+                        sleep(wait_ns / 1_000_000_000)
+
+                    # the state too, for the status broadcast
+                    state.set_apertures(apertures)
+                    state.set_solenoids(solenoids)
+                    xmit.send(apertures, solenoids, buttons if buttons.any() else None)
+                    frames += 1
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        print(f'replay: sent {frames} frames, turning off gas')
+        zeros = np.zeros(state.nozzles)
+        state.fill_apertures(0.0)
+        state.fill_solenoids(0)
+        xmit.send(zeros, zeros.astype(np.int32), None)
+        xmit.send_due_until()
+        xmit.close()
+
+
+#
+# Render. Runs a pattern as fast as it will go against a virtual clock, with no transmitter and
+# no network, and writes the frames it would have sent to a frame log (see framelog.py), which
+# --replay can play. With --seed the random patterns come out the same every time.
+#
+# The state's clock is a VirtualClock, so a classic pattern's sleep() moves virtual time on, and each
+# frame deadline it passes records the state as the pattern left it. A frame pattern is stepped a
+# frame at a time.
+#
+
+def frame_pattern_render(fn, state: LightCurveState, clock: VirtualClock) -> None:
+    steps = frame_pattern_steps(fn, state)
+    start_ns = last_ns = clock.now_ns()
+    try:
+        wait = next(steps)
+        while True:
+            state.commit()
+            for _ in range(wait or 1):
+                clock.advance(clock.next_frame_ns)
+            now = clock.now_ns()
+            wait = steps.send(((now - start_ns) / 1_000_000_000, (now - last_ns) / 1_000_000_000))
+            last_ns = now
+    except StopIteration:
+        state.commit()
+    finally:
+        steps.close()
+
+def flamatik_render(args, state: LightCurveState) -> None:
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+
+    fps = args.fps
+    frames = int(args.render_seconds * fps)
+    writer = framelog.FrameLogWriter(args.render, state.nozzles, frames, start_ns = 0)
+
+    # solenoid edges land on the frame after they're due, there's nothing between frames in a render
+    edges = EdgeSchedule(state.edges, state.nozzles)
+
+    r = np.zeros(1, dtype=writer.dtype)
+    def record(now_ns: int) -> None:
+        apertures, solenoids = state.current_frame()
+        edges.apply(now_ns)
+        solenoids = edges.overlay(solenoids)
+        r['time_ns'] = now_ns
+        r['sequence'] = writer.count
+        r['solenoids'] = framelog.pack_mask(solenoids)
+        r['apertures'] = framelog.quantize_apertures(apertures)
+        writer.write(r)
+
+    clock = VirtualClock(fps, frames * int(1_000_000_000 / fps), record)
+    state.clock = clock
+
+    # the pattern's module is imported after seeding, so what it randomizes at import is the same too
+    PATTERN_FUNCTIONS.set_sleep(state.sleep)
+    fn = PATTERN_FUNCTIONS[args.pattern]
+    # the pattern parameters the command line doesn't have, as a playlist entry would
+    pattern_args({ param: getattr(args, param, None) for param in PATTERN_PARAMETERS }, state)
+    print(f'render: {args.pattern} for {args.render_seconds} seconds at {fps} fps to {args.render}')
+
+    t1 = monotonic()
+    try:
+        while True:
+            started_ns = clock.now_ns()
+            state.frames.reset()
+            if is_frame_pattern(fn):
+                frame_pattern_render(fn, state, clock)
+            else:
+                fn(state)
+            # a pattern that ends without taking any time would go round forever
+            if clock.now_ns() == started_ns:
+                clock.advance(clock.next_frame_ns)
+    except ClockFinished:
+        pass
+    finally:
+        writer.close()
+
+    elapsed = monotonic() - t1
+    print(f'render: {writer.count} frames, {writer.count / fps:.1f} seconds in {elapsed:.2f} seconds, '
+          f'{writer.count / fps / max(elapsed, 1e-9):.0f}x real time')
+
+
 # only effects when we're being run as a module but whatever
 if __name__ == '__main__':
     main()
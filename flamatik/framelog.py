@@ -0,0 +1,255 @@
+# Frame logs: a compact binary record of the frames flamatik sent, to find out afterwards what the
+# sculpture actually did, and to replay it.
+#
+# A log file is a 64 byte header followed by fixed size records, one per frame, so a file can be
+# memory-mapped and read as a NumPy structured array. The header:
+#
+#   magic       4s   b'LCFL'
+#   version     B
+#   flags       B    0
+#   nozzles     H
+#   record_size I
+#   count       I    number of records written, updated as they are
+#   start_ns    q    monotonic nanoseconds when the file was started
+#   start_time  d    wall clock seconds at the same moment
+#
+# and each record (see record_dtype) holds the logical frame, what the patterns asked for, before
+# the controller mapping and calibration:
+#
+#   time_ns     monotonic nanoseconds when the frame was sent
+#   sequence    the transmitter's frame number
+#   imu_seq     the IMU sample's sequence number (0 if there never was one)
+#   solenoids   one bit per nozzle, nozzle 0 in the low bit of the first byte
+#   buttons     the same, for nozzles forced on by the buttons
+#   apertures   one byte per nozzle, 0 to 255 for 0.0 to 1.0
+#   imu         rotation, gravity, gyro (float32 x 9)
+#
+# With 30 nozzles that's 90 bytes a frame, about 117MB a day at 15 fps.
+#
+# FrameRecorder is the writing side used by the transmitter. record() only copies the frame into a
+# ring in memory; a thread moves it into the files every RECORD_FLUSH seconds, so the transmit loop
+# never waits on the disk. It writes a directory of files of a fixed size, and deletes the oldest
+# past a count. The files are numbered, 00000001.lcfl on, one more than the highest already there:
+# the Pi has no clock battery, so the wall clock can go backwards between boots, and names by time
+# wouldn't sort oldest first.
+
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterator
+
+import numpy as np
+
+FRAMELOG_MAGIC = b'LCFL'
+FRAMELOG_VERSION = 1
+FRAMELOG_HEADER = '<4sBBHIIqd'
+FRAMELOG_HEADER_SIZE = 64
+# offset of count in the header
+FRAMELOG_COUNT_OFFSET = 12
+
+FRAMELOG_SUFFIX = '.lcfl'
+
+def record_dtype(nozzles: int) -> np.dtype:
+    mask_bytes = (nozzles + 7) // 8
+    return np.dtype([
+        ('time_ns', '<i8'),
+        ('sequence', '<u4'),
+        ('imu_seq', '<u4'),
+        ('solenoids', 'u1', (mask_bytes,)),
+        ('buttons', 'u1', (mask_bytes,)),
+        ('apertures', 'u1', (nozzles,)),
+        ('imu', '<f4', (9,)),
+    ])
+
+def pack_mask(values: np.ndarray) -> np.ndarray:
+    return np.packbits(np.asarray(values, dtype=bool), bitorder='little')
+
+def unpack_mask(mask: np.ndarray, nozzles: int) -> np.ndarray:
+    return np.unpackbits(mask, count=nozzles, bitorder='little').astype(bool)
+
+def quantize_apertures(apertures: np.ndarray) -> np.ndarray:
+    return np.rint(np.clip(apertures, 0.0, 1.0) * 255.0).astype(np.uint8)
+
+def dequantize_apertures(apertures: np.ndarray) -> np.ndarray:
+    return apertures / 255.0
+
+
+# one file, mapped, that records are written into until it's full
+
+class FrameLogWriter:
+
+    def __init__(self, path: str, nozzles: int, capacity: int, start_ns: int = None) -> None:
+        self.path = path
+        self.nozzles = nozzles
+        self.dtype = record_dtype(nozzles)
+        self.capacity = capacity
+        self.count = 0
+
+        if start_ns is None:
+            start_ns = time.monotonic_ns()
+
+        self.file = open(path, 'w+b')
+        self.file.truncate(FRAMELOG_HEADER_SIZE + capacity * self.dtype.itemsize)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        struct.pack_into(FRAMELOG_HEADER, self.map, 0, FRAMELOG_MAGIC, FRAMELOG_VERSION, 0,
+                         nozzles, self.dtype.itemsize, 0, start_ns, time.time())
+        self.records = np.frombuffer(self.map, dtype=self.dtype, count=capacity, offset=FRAMELOG_HEADER_SIZE)
+
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    # write as many of records as fit, returns how many
+    def write(self, records: np.ndarray) -> int:
+        n = min(len(records), self.capacity - self.count)
+        self.records[self.count:self.count + n] = records[:n]
+        self.count += n
+        struct.pack_into('<I', self.map, FRAMELOG_COUNT_OFFSET, self.count)
+        return n
+
+    # cut the file down to what was written
+    def close(self) -> None:
+        del self.records
+        self.map.flush()
+        self.map.close()
+        self.file.truncate(FRAMELOG_HEADER_SIZE + self.count * self.dtype.itemsize)
+        self.file.close()
+
+
+# reading a file back, mapped, which works on a file that is still being written
+
+class FrameLogReader:
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.nozzles, record_size, self.count, self.start_ns, self.start_time = \
+            struct.unpack_from(FRAMELOG_HEADER, self.map, 0)
+        if magic != FRAMELOG_MAGIC or version != FRAMELOG_VERSION:
+            raise ValueError(f'{path} is not a frame log (version {FRAMELOG_VERSION})')
+        self.dtype = record_dtype(self.nozzles)
+        if record_size != self.dtype.itemsize:
+            raise ValueError(f'{path} has {record_size} byte records, expected {self.dtype.itemsize}')
+        # a file that wasn't closed is longer than what's in it
+        self.count = min(self.count, (len(self.map) - FRAMELOG_HEADER_SIZE) // record_size)
+        self.records = np.frombuffer(self.map, dtype=self.dtype, count=self.count, offset=FRAMELOG_HEADER_SIZE)
+
+    def __len__(self) -> int:
+        return self.count
+
+    # the records in order, copied out a chunk at a time, so the pages already read can be dropped
+    def __iter__(self) -> Iterator[np.void]:
+        chunk = max(1, mmap.PAGESIZE * 16 // self.dtype.itemsize)
+        for start in range(0, self.count, chunk):
+            for record in self.records[start:start + chunk].copy():
+                yield record
+            done = (FRAMELOG_HEADER_SIZE + (start + chunk) * self.dtype.itemsize) // mmap.PAGESIZE * mmap.PAGESIZE
+            if done and hasattr(mmap, 'MADV_DONTNEED'):
+                self.map.madvise(mmap.MADV_DONTNEED, 0, min(done, len(self.map) // mmap.PAGESIZE * mmap.PAGESIZE))
+
+    def close(self) -> None:
+        del self.records
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self) -> 'FrameLogReader':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# the number of a recording file, None for one that isn't numbered
+def framelog_index(path: str):
+    stem = os.path.basename(path)[:-len(FRAMELOG_SUFFIX)]
+    return int(stem) if stem.isdigit() else None
+
+# the files in a recording directory, oldest first: by number, after any that aren't numbered (by name)
+def framelog_files(directory: str):
+    files = [ os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(FRAMELOG_SUFFIX) ]
+    def order(path):
+        index = framelog_index(path)
+        return (0, 0, path) if index is None else (1, index, path)
+    return sorted(files, key=order)
+
+
+RECORD_FLUSH = 0.25
+
+class FrameRecorder:
+
+    def __init__(self, directory: str, nozzles: int, file_bytes: int = 16 * 1024 * 1024,
+                 files: int = 8, ring: int = 1024) -> None:
+        self.directory = directory
+        self.nozzles = nozzles
+        self.dtype = record_dtype(nozzles)
+        self.file_frames = max(1, (file_bytes - FRAMELOG_HEADER_SIZE) // self.dtype.itemsize)
+        self.files = max(1, files)
+        self.writer = None
+
+        # frames waiting for the thread. record() only moves head, the thread only moves tail
+        self.ring = np.zeros(ring, dtype=self.dtype)
+        self.head = 0
+        self.tail = 0
+        self.recorded = 0
+        self.dropped = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # called from the transmit loop, must not block: copy into the ring, or drop if it's full
+    def record(self, time_ns: int, sequence: int, apertures, solenoids, buttons, imu) -> None:
+        if self.head - self.tail >= len(self.ring):
+            self.dropped += 1
+            return
+        r = self.ring[self.head % len(self.ring)]
+        r['time_ns'] = time_ns
+        r['sequence'] = sequence & 0xffffffff
+        r['solenoids'] = pack_mask(solenoids)
+        r['buttons'] = pack_mask(buttons) if buttons is not None else 0
+        r['apertures'] = quantize_apertures(apertures)
+        if imu is not None:
+            r['imu_seq'] = imu.seq & 0xffffffff
+            r['imu'][0:3] = imu.rotation
+            r['imu'][3:6] = imu.gravity
+            r['imu'][6:9] = imu.gyro
+        else:
+            r['imu_seq'] = 0
+            r['imu'] = 0.0
+        self.head += 1
+
+    def open_file(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        files = framelog_files(self.directory)
+        index = max([ framelog_index(f) or 0 for f in files ] + [ 0 ]) + 1
+        path = os.path.join(self.directory, f'{index:08d}{FRAMELOG_SUFFIX}')
+        self.writer = FrameLogWriter(path, self.nozzles, self.file_frames)
+        for old in (files + [ path ])[:-self.files]:
+            if old != path:
+                os.remove(old)
+
+    def flush(self) -> None:
+        while self.tail < self.head:
+            if self.writer is None or self.writer.full():
+                self.open_file()
+            start = self.tail % len(self.ring)
+            end = min(start + (self.head - self.tail), len(self.ring))
+            n = self.writer.write(self.ring[start:end])
+            self.tail += n
+            self.recorded += n
+
+    def run(self) -> None:
+        while not self.stop.wait(RECORD_FLUSH):
+            self.flush()
+
+    def close(self) -> None:
+        self.stop.set()
+        self.thread.join()
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
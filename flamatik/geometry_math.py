@@ -1,6 +1,9 @@
 # This file contains math helper functions useful to many patterns, such as the directional vector
 # for each nozzle on the star, and functions to help deal with them.
 
+import numpy as np
+import face_groupings as g
+
 nozzle_vectors = [
     ( -0.0,         0.76942086,  1.2449492  ),
     ( -0.7317627,   0.23776406,  1.2449491  ),
@@ -39,7 +42,7 @@ nozzle_vectors = [
 def dot(a: tuple[float, float, float], b: tuple[float, float, float]):
     return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
 
-# Brute-force algorithm to find closest nozzle to a given vector, comparing direction using dot product.
+# Find the closest nozzle to a given vector, comparing direction using dot product.
 # Note that you can either pass the full nozzle_vectors list to get the closest nozzle out of all of them, or a subset of the list if you want.
 #
 # Examples (using arrays from face_groupings):
@@ -52,12 +55,104 @@ def dot(a: tuple[float, float, float], b: tuple[float, float, float]):
 #
 # Get the closest nozzle out of the horizontal equator and the upper facing star:
 # closest_nozzle(v, equators[0] + stars[5])
+#
+# This is now done with one matrix product over the cached matrix for that list of nozzles, see below.
 def closest_nozzle(vec: tuple[float, float, float], nozzles: list[int]) -> int:
-    closest_nozzle_index = 0
-    closest_nozzle_dot_product = dot(vec, nozzle_vectors[nozzles[0]])
-    for i in range(1, len(nozzles)):
-        d = dot(vec, nozzle_vectors[nozzles[i]])
-        if d > closest_nozzle_dot_product:
-            closest_nozzle_index = i
-            closest_nozzle_dot_product = d
-    return nozzles[closest_nozzle_index]
+    idx, matrix = submatrix(nozzles)
+    return int(idx[np.argmax(matrix @ np.asarray(vec, dtype=float))])
+
+
+# Vectorized versions. The nozzle directions are kept as a normalized 30 x 3 matrix, and for
+# every list of nozzles asked about, the rows for those nozzles are cut out once and cached.
+# The equators, stars and all nozzles are cached up front.
+
+nozzle_matrix = np.array(nozzle_vectors)
+nozzle_matrix /= np.linalg.norm(nozzle_matrix, axis=1, keepdims=True)
+
+_submatrices = {}
+
+# (nozzle index array, matrix of their normalized directions) for a list of nozzles
+def submatrix(nozzles: list[int]):
+    key = tuple(nozzles)
+    r = _submatrices.get(key)
+    if r is None:
+        idx = np.array(key, dtype=np.intp)
+        r = (idx, nozzle_matrix[idx])
+        _submatrices[key] = r
+    return r
+
+for _nozzles in [g.all_nozzles] + g.equators + g.stars:
+    submatrix(_nozzles)
+
+# The k nozzles closest in direction to vec, closest first.
+def closest_nozzles(vec: tuple[float, float, float], nozzles: list[int], k: int = 1) -> list[int]:
+    idx, matrix = submatrix(nozzles)
+    d = matrix @ np.asarray(vec, dtype=float)
+    return idx[np.argsort(-d, kind='stable')[:k]].tolist()
+
+# A weight from 0 to 1 for each of the nozzles: the cosine of the angle between the nozzle
+# and vec, to a power for a sharper falloff, and 0 for the ones facing away.
+def falloff(vec: tuple[float, float, float], nozzles: list[int], power: float = 2.0) -> np.ndarray:
+    idx, matrix = submatrix(nozzles)
+    v = np.asarray(vec, dtype=float)
+    n = np.linalg.norm(v)
+    if n == 0.0:
+        return np.zeros(len(idx))
+    return np.maximum(matrix @ (v / n), 0.0) ** power
+
+
+# A lookup table from direction to closest nozzle, for patterns that ask every frame (like the IMU ones).
+# Directions are binned on a cube map: the largest component picks one of 6 faces, and the other two,
+# divided by it, pick a cell in a resolution x resolution grid on that face. Each cell holds the
+# closest nozzle to the direction at its center, so a lookup is some arithmetic and an index.
+# It can be off near the edge between two nozzles, by less than a cell (about 90 / resolution degrees).
+
+class DirectionLookup:
+
+    def __init__(self, nozzles: list[int], resolution: int = 64):
+        self.nozzles = list(nozzles)
+        self.resolution = resolution
+
+        # the direction at the center of every cell, for all 6 faces
+        centers = (np.arange(resolution) + 0.5) / resolution * 2.0 - 1.0
+        u, v = np.meshgrid(centers, centers, indexing='ij')
+        one = np.ones_like(u)
+        faces = []
+        for axis in range(3):
+            for sign in (1.0, -1.0):
+                d = np.empty(u.shape + (3,))
+                d[..., axis] = sign * one
+                d[..., (axis + 1) % 3] = u
+                d[..., (axis + 2) % 3] = v
+                faces.append(d)
+        directions = np.stack(faces).reshape(-1, 3)
+
+        idx, matrix = submatrix(self.nozzles)
+        self.table = idx[np.argmax(directions @ matrix.T, axis=1)]
+
+    def closest(self, vec: tuple[float, float, float]) -> int:
+        x, y, z = float(vec[0]), float(vec[1]), float(vec[2])
+        a = (abs(x), abs(y), abs(z))
+        axis = a.index(max(a))
+        big = (x, y, z)[axis]
+        if big == 0.0:
+            # no direction at all, same answer as closest_nozzle
+            return self.nozzles[0]
+        face = axis * 2 + (0 if big > 0.0 else 1)
+        u = (x, y, z)[(axis + 1) % 3] / a[axis]
+        v = (x, y, z)[(axis + 2) % 3] / a[axis]
+        r = self.resolution
+        i = min(int((u + 1.0) * 0.5 * r), r - 1)
+        j = min(int((v + 1.0) * 0.5 * r), r - 1)
+        return int(self.table[(face * r + i) * r + j])
+
+_lookups = {}
+
+# closest_nozzle through a lookup table, built the first time it's asked for those nozzles
+def closest_nozzle_lookup(vec: tuple[float, float, float], nozzles: list[int]) -> int:
+    key = tuple(nozzles)
+    lookup = _lookups.get(key)
+    if lookup is None:
+        lookup = DirectionLookup(nozzles)
+        _lookups[key] = lookup
+    return lookup.closest(vec)
@@ -0,0 +1,76 @@
+# NumPy versions of the groupings in face_groupings.py and the vectors in geometry_math.py,
+# so a pattern can compute a whole frame with array operations and write it to the state
+# in one call (state.set_apertures / state.set_solenoids) instead of one call per nozzle.
+#
+# Groupings come as index arrays, one row per group (e.g. stars[3] is the 5 nozzles of star 3),
+# and as boolean masks over all the nozzles (star_masks[3][n] is True if n is in star 3).
+#
+# Example, a cosine wave around the horizontal equator:
+#
+#   state.set_apertures(na.equator_wave(0, phase), na.equators[0])
+#
+# Example, open everything facing up, more the more directly up it faces:
+#
+#   d = na.dot_all(up)
+#   state.set_solenoids(d > 0.0)
+#   state.set_apertures(np.clip(d * d, 0.0, 1.0) * (d > 0.0))
+
+import numpy as np
+from math import tau
+
+import face_groupings as g
+import geometry_math as m
+
+NOZZLES = len(g.all_nozzles)
+
+all_nozzles = np.array(g.all_nozzles)
+
+# indexed by nozzle, like face_groupings
+opposite = np.array(g.opposite)
+neighbors = np.array(g.neighbors)
+orthogonals = np.array(g.orthogonals)
+
+# one row per group
+stars = np.array(g.stars)
+triples = np.array(g.triples)
+halos = np.array(g.halos)
+equators = np.array(g.equators)
+
+# the nozzle directions as a 30 x 3 matrix, as in geometry_math (not normalized)
+nozzle_vectors = np.array(m.nozzle_vectors)
+
+def mask(nozzles) -> np.ndarray:
+    # boolean array over all the nozzles, True for the ones given
+    r = np.zeros(NOZZLES, dtype=bool)
+    r[nozzles] = True
+    return r
+
+def masks(groups: np.ndarray) -> np.ndarray:
+    # one mask row per group
+    r = np.zeros((len(groups), NOZZLES), dtype=bool)
+    for i, group in enumerate(groups):
+        r[i, group] = True
+    return r
+
+star_masks = masks(stars)
+triple_masks = masks(triples)
+halo_masks = masks(halos)
+equator_masks = masks(equators)
+
+def set_indices(values: np.ndarray, nozzles, val) -> np.ndarray:
+    # set these nozzles of a per-nozzle array to a value, or to one value each
+    values[nozzles] = val
+    return values
+
+def wave(count: int, phase: float, mean: float = 0.5, amplitude: float = 0.5) -> np.ndarray:
+    # one cosine period spread over count positions, shifted by phase (in periods)
+    return mean + amplitude * np.cos((np.arange(count) / count + phase) * tau)
+
+def equator_wave(equator: int, phase: float, mean: float = 0.5, amplitude: float = 0.5) -> np.ndarray:
+    # a cosine wave over the nozzles of an equator, in the order of equators[equator],
+    # clipped at 0. Rotate it around by moving phase from 0 to 1.
+    return np.maximum(0.0, wave(len(equators[equator]), phase, mean, amplitude))
+
+def dot_all(vec) -> np.ndarray:
+    # dot product of every nozzle direction with a vector, one value per nozzle
+    return nozzle_vectors @ np.asarray(vec, dtype=float)
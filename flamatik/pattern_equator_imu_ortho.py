@@ -20,8 +20,8 @@ def pattern_equator_imu_ortho(state: ft.LightCurveState) -> bool:
     state.fill_solenoids(0)
     state.fill_apertures(1.0)
 
-    gravity = (state.s.gravity[0], state.s.gravity[1], state.s.gravity[2])
-    nozzle_in_imu_direction = m.closest_nozzle(gravity, equator)
+    gravity = state.imu_snapshot().gravity
+    nozzle_in_imu_direction = m.closest_nozzle_lookup(gravity, equator)
     for nozzle in approx_orthogonals_within_equator[nozzle_in_imu_direction]:
         state.s.solenoids[nozzle] = 1
     sleep(0.1)
@@ -14,7 +14,7 @@ def pattern_equator_imu_single(state: ft.LightCurveState) -> bool:
     state.fill_solenoids(0)
     state.fill_apertures(1.0)
 
-    gravity = (state.s.gravity[0], state.s.gravity[1], state.s.gravity[2])
-    nozzle = m.closest_nozzle(gravity, equator)
+    gravity = state.imu_snapshot().gravity
+    nozzle = m.closest_nozzle_lookup(gravity, equator)
     state.s.solenoids[nozzle] = 1
     sleep(0.1)
@@ -5,6 +5,7 @@
 # want the globals and helper functions from flametest
 import flamatik as ft
 from time import sleep
+import numpy as np
 
 # multiwave controls the apertures
 # have a wave size less than the number of nozzles
@@ -38,8 +39,7 @@ def pattern_multiwave(state: ft.LightCurveState) -> bool:
   # overlay the pattern
   for i in range(state.nozzles):
 
-    for j in range(waveSteps):
-        state.s.apertures[ (i + j) % state.nozzles] = pattern[j]
+    state.set_apertures(pattern, (i + np.arange(waveSteps)) % state.nozzles)
 
     print(f'wave offset: {i} shifting: apertures')
     # since state is shared,
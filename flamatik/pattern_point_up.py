@@ -13,7 +13,8 @@ def pattern_point_up(state: ft.LightCurveState) -> bool:
     state.fill_solenoids(0)
     state.fill_apertures(1.0)
 
-    reverse_gravity = (-state.s.gravity[0], -state.s.gravity[1], -state.s.gravity[2])
-    nozzle_opposite_to_imu_direction = m.closest_nozzle(reverse_gravity, g.all_nozzles)
+    gravity = state.imu_snapshot().gravity
+    reverse_gravity = (-gravity[0], -gravity[1], -gravity[2])
+    nozzle_opposite_to_imu_direction = m.closest_nozzle_lookup(reverse_gravity, g.all_nozzles)
     state.s.solenoids[nozzle_opposite_to_imu_direction] = 1
     sleep(0.05)
@@ -21,24 +21,26 @@ def pattern_random_star_fade(state: ft.LightCurveState) -> bool:
 
     star_index = random.randint(0, len(g.stars) - 1)
 
+    star = g.stars[star_index]
+
+    # Each frame is committed whole, so the controllers never see half a star.
     # Open solenoids for selected star
-    for nozzle in g.stars[star_index]:
-        state.s.solenoids[nozzle] = 1
+    state.set_solenoids(1, star)
 
     # Grow
     for progress in range(frames_per_period):
         prog = progress / frames_per_period
-        for nozzle in g.stars[star_index]:
-            state.s.apertures[nozzle] = min_aperture + prog * aperture_range
+        with state.frame():
+            state.set_apertures(min_aperture + prog * aperture_range, star)
         sleep(fade_period / frames_per_period)
 
     # Shrink
     for progress in range(frames_per_period):
         prog = progress / frames_per_period
-        for nozzle in g.stars[star_index]:
-            state.s.apertures[nozzle] = max_aperture - prog * aperture_range
+        with state.frame():
+            state.set_apertures(max_aperture - prog * aperture_range, star)
         sleep(fade_period / frames_per_period)
 
     # Close solenoids for selected star
-    for nozzle in g.stars[star_index]:
-        state.s.solenoids[nozzle] = 0
+    with state.frame():
+        state.set_solenoids(0, star)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+# Short poofs, shorter than a frame, timed by the transmitter. See state.poof.
+
+import random
+import flamatik as ft
+from time import sleep
+import face_groupings as g
+
+def pattern_staccato(state: ft.LightCurveState) -> bool:
+    state.fill_solenoids(0)
+    state.fill_apertures(1.0)
+
+    # how long each poof is
+    poof = 0.05
+    if state.args.delay is not None:
+        poof = state.args.delay
+
+    # and how often
+    frame_delay = 0.15
+    if state.args.frame_delay is not None:
+        frame_delay = state.args.frame_delay
+
+    # schedule a little ahead, so the first edge isn't late
+    t = state.now() + 0.1
+    for _ in range(16):
+        nozzle = random.choice(g.all_nozzles)
+        state.poof(nozzle, poof, start=t)
+        t += frame_delay
+        sleep(frame_delay)
@@ -5,8 +5,7 @@
 import flamatik as ft
 from time import sleep
 import numpy as np
-import face_groupings as g
-import geometry_math as m
+import nozzle_arrays as na
 
 old_gravity = None
 
@@ -18,18 +17,20 @@ def pattern_trail(state: ft.LightCurveState) -> bool:
     state.fill_solenoids(0)
     state.fill_apertures(0.0)
 
-    if old_gravity == None:
-        old_gravity = (state.s.gravity[0], state.s.gravity[1], state.s.gravity[2])
-    elif old_gravity[0] != state.s.gravity[0] and old_gravity[1] != state.s.gravity[1] and old_gravity[2] != state.s.gravity[2]:
-        motion_direction = (state.s.gravity[0] - old_gravity[0], state.s.gravity[1] - old_gravity[1], state.s.gravity[2] - old_gravity[2])
-        old_gravity = (state.s.gravity[0], state.s.gravity[1], state.s.gravity[2])
+    # one consistent read of the IMU
+    gravity = state.imu_snapshot().gravity
+
+    if old_gravity is None:
+        old_gravity = gravity
+    elif np.all(old_gravity != gravity):
+        motion_direction = gravity - old_gravity
+        old_gravity = gravity
 
         motion_direction /= np.linalg.norm(motion_direction)
 
-        for nozzle in g.all_nozzles:
-            d = m.dot(m.nozzle_vectors[nozzle], motion_direction)
-            if d > 0.0:
-                state.s.solenoids[nozzle] = 1
-                state.s.apertures[nozzle] = min(d * d, 1.0)
+        d = na.dot_all(motion_direction)
+        away = d > 0.0
+        state.set_solenoids(away.astype(int))
+        state.set_apertures(np.where(away, np.minimum(d * d, 1.0), 0.0))
 
     sleep(0.05)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Stopping a pattern has to close the solenoids it left open, whatever style the pattern is.
+#
+# python3 -m pytest test_pattern_runtime.py
+
+import argparse
+import json
+import os
+from threading import Timer
+
+import flamatik as ft
+
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim_test.cnf')
+
+
+def make_state() -> ft.LightCurveState:
+    with open(CONFIG) as f:
+        conf = json.load(f)
+    args = argparse.Namespace(controllers=conf['controllers'], nozzles=conf['nozzles'],
+                              aperture_calibration=conf['aperture_calibration'],
+                              state_backend='shared_memory', fps=15, workers=2)
+    return ft.LightCurveState(args, None)
+
+
+# run fn as job 1 in worker 0, asking it to stop after a few frames
+def run_and_stop(state: ft.LightCurveState, fn) -> None:
+    job_id = 1
+    state.job = job_id
+    state.runtime_ctl[ft._worker_running(0)] = job_id
+    handle = ft.PatternHandle({}, state)
+    handle.id = job_id
+    stop = Timer(0.3, handle.terminate)
+    stop.start()
+    try:
+        ft.pattern_job(fn, state, job_id)
+    finally:
+        stop.join()
+
+
+def open_frame_pattern(state):
+    while True:
+        state.s.solenoids[10:20] = 1
+        yield 1
+
+
+def open_classic_pattern(state):
+    state.s.solenoids[10:20] = 1
+    state.commit()
+    while True:
+        state.sleep(0.05)
+
+
+def test_cancelled_frame_pattern_closes_solenoids():
+    state = make_state()
+    run_and_stop(state, open_frame_pattern)
+    apertures, solenoids = state.current_frame()
+    assert not solenoids.any()
+
+
+def test_cancelled_classic_pattern_closes_solenoids():
+    state = make_state()
+    run_and_stop(state, open_classic_pattern)
+    apertures, solenoids = state.current_frame()
+    assert not solenoids.any()
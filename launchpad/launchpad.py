@@ -30,6 +30,7 @@ from osc4py3 import oscbuildparse, oscchannel, oscmethod as osm
 
 import requests
 import socket
+import struct
 import netifaces
 
 import os
@@ -89,6 +90,9 @@ class Mode(ABC):
 # if we don't receive data in 3 seconds, its dead
 FLAMATIK_TIMEOUT = 3.0
 
+# flamatik answers a command once it has switched, which is well under this
+COMMAND_TIMEOUT = 0.150
+
 class FlamatikStatus():
     def __init__(self, lpm: 'LaunchpadMiniMk2'):
         self.nozzles = 30
@@ -617,6 +621,8 @@ class PatternMode(Mode):
         self.status = status
         self.row = -1
         self.column = -1
+        # one session keeps the connection to flamatik open between button presses
+        self.session = requests.Session()
 
         pattern_json_f = "pattern_mode.cnf"
         if not os.path.exists(pattern_json_f):
@@ -729,9 +735,13 @@ class PatternMode(Mode):
         print('pattern change: uri ',uri)
 
         try:
-            response = requests.post(uri, json=msg, timeout=0.020)
+            response = self.session.post(uri, json=msg, timeout=COMMAND_TIMEOUT)
             if response.status_code == 200:
-                print(f'success: sent {pattern_o} to launchpad at {address}')
+                accepted = response.json().get('accepted')
+                if accepted is False:
+                    print(f'fail: flamatik at {address} refused {pattern_o}: {response.json().get("reason")}')
+                else:
+                    print(f'success: sent {pattern_o} to launchpad at {address} accepted {accepted}')
             else:
                 print(f'fail: response code {response.status_code} from request to launchpad at {address}')
         except requests.exceptions.Timeout:
@@ -748,9 +758,13 @@ class PatternMode(Mode):
         print('pattern reset: uri ',uri)
 
         try:
-            response = requests.post(uri, json=msg, timeout=0.020)
+            response = self.session.post(uri, json=msg, timeout=COMMAND_TIMEOUT)
             if response.status_code == 200:
-                print(f'success: sent patternReset to launchpad at {address}')
+                accepted = response.json().get('accepted')
+                if accepted is False:
+                    print(f'fail: flamatik at {address} refused patternReset: {response.json().get("reason")}')
+                else:
+                    print(f'success: sent patternReset to launchpad at {address} accepted {accepted}')
             else:
                 print(f'fail: response code {response.status_code} from request to launchpad at {address}')
         except requests.exceptions.Timeout:
@@ -766,6 +780,32 @@ class PatternMode(Mode):
 # It's both interesting and lets us know where to send commands (directed)
 #
 
+# Flamatik sends either JSON, or a fixed layout binary packet (see LightCurveStatusXmit
+# in flamatik.py). The binary one starts with the magic, and has a version byte, so we only decode
+# versions we know, and turn them into the same dict the JSON has.
+
+STATUS_BINARY_MAGIC = b'LCST'
+STATUS_BINARY_VERSION = 2
+STATUS_BINARY_HEADER = '<4sBBHIIIB'
+STATUS_BINARY_HEADER_LEN = struct.calcsize(STATUS_BINARY_HEADER)
+
+def status_binary_decode(data: bytes):
+    if len(data) < STATUS_BINARY_HEADER_LEN:
+        return None
+    magic, version, flags, command_port, uptime_ms, seq, mask, nozzles = struct.unpack_from(STATUS_BINARY_HEADER, data)
+    if version != STATUS_BINARY_VERSION or len(data) < STATUS_BINARY_HEADER_LEN + nozzles:
+        return None
+    apertures = memoryview(data)[STATUS_BINARY_HEADER_LEN:STATUS_BINARY_HEADER_LEN + nozzles]
+    return {
+        "device": "lightcurve",
+        "version": str(version),
+        "command_port": command_port,
+        "uptime": uptime_ms / 1000.0,
+        "solenoids": [ (mask >> i) & 1 for i in range(nozzles) ],
+        "apertures": [ a / 255.0 for a in apertures ],
+        "seq": seq,
+    }
+
 class StatusReceiver():
     def __init__(self):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -774,11 +814,19 @@ class StatusReceiver():
     def recv(self, flam: FlamatikStatus):
         data, addr = self.sock.recvfrom(2000)
 
+        if data[:4] == STATUS_BINARY_MAGIC:
+            parsed_data = status_binary_decode(data)
+            if parsed_data is None:
+                print(f' bad or unknown version binary status addr: {addr[0]} len {len(data)}')
+                return
+            flam.set(addr, parsed_data)
+            return
+
         try:
             json_data = data.decode('ascii')
             parsed_data = json.loads(json_data)
-        except json.JSONDecodeError:
-            print(f' bad status data parse addr: {addr[0]} data {parsed_data}')
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            print(f' bad status data parse addr: {addr[0]} data {data}')
             return
 
        # print(f' received uptime {parsed_data["uptime"]} from device {parsed_data["device"]} address {addr[0]}')
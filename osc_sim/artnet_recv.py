@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# A stand in for a controller, for testing flamatik without the sculpture. Receives Art-Net
+# the way controller.ino does, and prints the solenoids and apertures whenever they change.
+#
+# The packets are what flamatik sends: an 18 byte artdmx header, then two bytes per nozzle,
+# solenoid (0 or 1) and aperture (0 to 255).
+#
+# With --sync it behaves like a controller in artsync mode: artdmx data is held, and applied
+# when an artsync (opcode 0x5200) arrives. As the Art-Net spec says, if no artsync has been seen
+# for 4 seconds it goes back to applying artdmx as it arrives. Set "artsync": true on the
+# controller in flamatik's config to have it send them.
+#
+# python3 artnet_recv.py --sync
+
+import argparse
+import socket
+import struct
+from time import monotonic
+
+ARTNET_PORT = 6454
+ARTNET_HEADER_SIZE = 18
+
+OP_DMX = 0x5000
+OP_SYNC = 0x5200
+
+# how long after the last artsync to go back to applying artdmx straight away
+SYNC_TIMEOUT = 4.0
+
+# print counters this often
+STATS_INTERVAL = 5.0
+
+
+class ArtnetReceiver:
+
+    def __init__(self, sync: bool, quiet: bool) -> None:
+        self.sync = sync
+        self.quiet = quiet
+        self.last_sync = None
+        self.pending = None
+        self.applied = None
+        self.start = monotonic()
+        self.stats = { 'dmx': 0, 'sync': 0, 'applied': 0, 'replaced': 0, 'other': 0 }
+
+    def syncing(self, now: float) -> bool:
+        return self.sync and self.last_sync is not None and now - self.last_sync < SYNC_TIMEOUT
+
+    def receive(self, data: bytes, now: float) -> None:
+        if len(data) < 12 or data[0:8] != b'Art-Net\x00':
+            self.stats['other'] += 1
+            return
+        opcode = struct.unpack_from('<H', data, 8)[0]
+
+        if opcode == OP_DMX and len(data) >= ARTNET_HEADER_SIZE:
+            self.stats['dmx'] += 1
+            length = struct.unpack_from('>H', data, 16)[0]
+            frame = (data[12], bytes(data[ARTNET_HEADER_SIZE:ARTNET_HEADER_SIZE + length]))
+            if self.syncing(now):
+                # a second artdmx before the sync: only the latest is applied
+                if self.pending is not None:
+                    self.stats['replaced'] += 1
+                self.pending = frame
+            else:
+                self.apply(frame, now)
+
+        elif opcode == OP_SYNC:
+            self.stats['sync'] += 1
+            self.last_sync = now
+            if self.sync and self.pending is not None:
+                self.apply(self.pending, now)
+                self.pending = None
+
+        else:
+            self.stats['other'] += 1
+
+    def apply(self, frame, now: float) -> None:
+        self.stats['applied'] += 1
+        sequence, data = frame
+        if self.applied is not None and self.applied[1] == data:
+            self.applied = frame
+            return
+        self.applied = frame
+        if not self.quiet:
+            solenoids = ''.join( '1' if b else '.' for b in data[0::2] )
+            apertures = ' '.join( f'{b:02x}' for b in data[1::2] )
+            print(f'{now - self.start:9.3f} seq {sequence:3d} {solenoids}  {apertures}')
+
+
+def artnet_receiver(args) -> None:
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.address, args.port))
+    sock.settimeout(1.0)
+    print(f'Listening for Art-Net on {args.address}:{args.port}' + (' in artsync mode' if args.sync else ''))
+
+    receiver = ArtnetReceiver(args.sync, args.quiet)
+    next_stats = monotonic() + STATS_INTERVAL
+    try:
+        while True:
+            try:
+                data, address = sock.recvfrom(2048)
+                receiver.receive(data, monotonic())
+            except socket.timeout:
+                pass
+
+            if monotonic() > next_stats:
+                print(f' stats: {receiver.stats}' + (f' syncing {receiver.syncing(monotonic())}' if args.sync else ''))
+                next_stats += STATS_INTERVAL
+    except KeyboardInterrupt:
+        pass
+    print(f' stats: {receiver.stats}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Receive Art-Net like a Light Curve controller')
+    parser.add_argument('--address', '-a', default='0.0.0.0', type=str, help='address to listen on')
+    parser.add_argument('--port', '-p', default=ARTNET_PORT, type=int, help='port to listen on')
+    parser.add_argument('--sync', '-s', action='store_true', help='apply artdmx only when an artsync arrives')
+    parser.add_argument('--quiet', '-q', action='store_true', help='only print the counters')
+    artnet_receiver(parser.parse_args())